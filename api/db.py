@@ -0,0 +1,374 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from databases import Database, DatabaseURL
+from fastapi import HTTPException
+
+from cache import TTLCache
+from metrics import observe_query
+
+# コネクションプールの最小・最大接続数と、接続を作り直すまでの時間（秒）
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 10))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 3600))
+# 空き接続を待つ上限（秒）。超えた場合は待ち続けずに503を返す
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get("DB_POOL_ACQUIRE_TIMEOUT", 5.0))
+DB_POOL_RETRY_AFTER = int(os.environ.get("DB_POOL_RETRY_AFTER", 1))
+
+# 書き込んだユーザーの読み込みをプライマリに向ける時間（秒）。レプリカの遅延より長くする
+READ_YOUR_WRITES_WINDOW = float(os.environ.get("READ_YOUR_WRITES_WINDOW", 5))
+# 書き込んだユーザーの記録を全ワーカーで共有するRedisのURL（未設定の場合はワーカーごとに記録する）
+READ_YOUR_WRITES_REDIS_URL = os.environ.get("READ_YOUR_WRITES_REDIS_URL")
+# レプリカへの接続・クエリに失敗した後、プライマリだけを使う時間（秒）
+DB_REPLICA_RETRY_INTERVAL = float(os.environ.get("DB_REPLICA_RETRY_INTERVAL", 10))
+
+logger = logging.getLogger(__name__)
+
+
+class PoolExhausted(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=503,
+            detail="Database is busy, please retry later",
+            headers={"Retry-After": str(DB_POOL_RETRY_AFTER)},
+        )
+
+
+class PoolGate:
+    """
+    Bound the number of checked-out connections and record how long callers wait for one.
+    """
+
+    def __init__(self, size: int, timeout: float):
+        self.size = size
+        self.timeout = timeout
+        self._semaphore: asyncio.Semaphore = None
+        self.waiting = 0
+        self.max_waiting = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.acquisitions = 0
+        self.timeouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def start(self):
+        # Python 3.8 ではセマフォが生成時のイベントループに紐づくため、起動時に生成する
+        self._semaphore = asyncio.Semaphore(self.size)
+
+    async def acquire(self):
+        if self._semaphore is None:
+            self.start()
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise PoolExhausted()
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - queued_at
+        self.acquisitions += 1
+        self.total_wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        self.in_use += 1
+        self.max_in_use = max(self.max_in_use, self.in_use)
+
+    def release(self):
+        self.in_use -= 1
+        self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_size": self.size,
+            "acquire_timeout": self.timeout,
+            "in_use": self.in_use,
+            "max_in_use": self.max_in_use,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "acquisitions": self.acquisitions,
+            "timeouts": self.timeouts,
+            "avg_wait_seconds": self.total_wait_seconds / self.acquisitions if self.acquisitions else 0.0,
+            "max_wait_seconds": self.max_wait_seconds,
+        }
+
+
+class PooledDatabase(Database):
+    """
+    Database with an explicitly sized pool that fails fast with 503 when no connection frees up in time.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        min_size: int = DB_POOL_MIN_SIZE,
+        max_size: int = DB_POOL_MAX_SIZE,
+        recycle: int = DB_POOL_RECYCLE,
+        acquire_timeout: float = DB_POOL_ACQUIRE_TIMEOUT,
+        name: str = "primary",
+    ):
+        url = DatabaseURL(url)
+        options = {}
+        # プールの設定はaiomysqlにだけ渡す（テスト用のSQLiteには該当する設定がない）
+        if url.dialect == "mysql":
+            options = dict(min_size=min_size, max_size=max_size, pool_recycle=recycle)
+        super().__init__(url, **options)
+        self.name = name
+        self.min_size = min_size
+        self.gate = PoolGate(max_size, acquire_timeout)
+        # ゲートを通過しているタスク（トランザクション内のクエリが二重に待たないようにする）
+        self._gate_holder: ContextVar = ContextVar(f"gate_holder_{id(self)}", default=None)
+
+    async def connect(self) -> None:
+        self.gate.start()
+        await super().connect()
+
+    @asynccontextmanager
+    async def _gated(self):
+        # ライブラリ内部の接続管理には手を入れず、公開されているクエリ・トランザクションのメソッドの外側で待つ
+        # コンテキストを引き継いだ子タスクは別の接続を使うため、タスクで判定する
+        task = asyncio.current_task()
+        if self._gate_holder.get() is task:
+            yield
+            return
+        await self.gate.acquire()
+        token = self._gate_holder.set(task)
+        try:
+            yield
+        finally:
+            self._gate_holder.reset(token)
+            self.gate.release()
+
+    # クエリの形ごとのレイテンシ（接続の待ち時間を含む）とリクエストごとのクエリ数を記録する
+    async def fetch_all(self, query, values: Optional[dict] = None):
+        with observe_query(self.name, query):
+            async with self._gated():
+                return await super().fetch_all(query, values)
+
+    async def fetch_one(self, query, values: Optional[dict] = None):
+        with observe_query(self.name, query):
+            async with self._gated():
+                return await super().fetch_one(query, values)
+
+    async def fetch_val(self, query, values: Optional[dict] = None, column=0):
+        with observe_query(self.name, query):
+            async with self._gated():
+                return await super().fetch_val(query, values, column)
+
+    async def execute(self, query, values: Optional[dict] = None):
+        with observe_query(self.name, query):
+            async with self._gated():
+                return await super().execute(query, values)
+
+    async def execute_many(self, query, values: list):
+        with observe_query(self.name, query):
+            async with self._gated():
+                return await super().execute_many(query, values)
+
+    async def iterate(self, query, values: Optional[dict] = None):
+        async with self._gated():
+            async for record in super().iterate(query, values):
+                yield record
+
+    @asynccontextmanager
+    async def transaction(self, **kwargs):
+        # トランザクションの間は1つの接続を使い続けるため、終了までゲートを保持する
+        async with self._gated():
+            async with super().transaction(**kwargs) as transaction:
+                yield transaction
+
+    def stats(self) -> dict:
+        stats = dict(self.gate.stats(), min_size=self.min_size)
+        pool = getattr(self._backend, "_pool", None)
+        if pool is not None and hasattr(pool, "freesize"):
+            stats["open_connections"] = pool.size
+            stats["idle_connections"] = pool.freesize
+        return stats
+
+
+async def consecutive_insert_ids(database: Database) -> bool:
+    """
+    Whether a multi-row INSERT is guaranteed consecutive ids starting at the id it returns.
+
+    MySQL guarantees it with innodb_autoinc_lock_mode <= 1 (the 5.7 default) and
+    auto_increment_increment = 1. Mode 2 (the 8.0 default) may interleave ids of concurrent inserts.
+    """
+    if database.url.dialect != "mysql":
+        return False
+    row = await database.fetch_one("SELECT @@innodb_autoinc_lock_mode AS lock_mode, @@auto_increment_increment AS increment")
+    return int(row.lock_mode) <= 1 and int(row.increment) == 1
+
+
+def is_integrity_error(error: Exception) -> bool:
+    """
+    Whether `error` is a constraint violation (a duplicate key, for instance) raised by the database driver.
+    """
+    # aiomysql（pymysql）とsqlite3のIntegrityErrorは共通の基底クラスを持たないため、DB-APIの例外名で判定する
+    return any(cls.__name__ == "IntegrityError" for cls in type(error).__mro__)
+
+
+class ReadRouter:
+    """
+    Send read-only queries to an optional replica, falling back to the primary.
+
+    Reads go to the primary when no replica is configured, when the replica has recently
+    failed, or when the caller (`sub`) wrote within READ_YOUR_WRITES_WINDOW. Reads of a shared
+    listing (`table`) go to the primary for the window after anyone writes to it, since their
+    results are cached and served to every user. Writes are remembered in this process and,
+    with READ_YOUR_WRITES_REDIS_URL, in Redis so that every worker sees them. A row missing on the replica is looked up again on the primary, since
+    it may not have replicated yet.
+    """
+
+    def __init__(
+        self,
+        primary: Database,
+        replica: Optional[PooledDatabase] = None,
+        window: float = READ_YOUR_WRITES_WINDOW,
+        retry_interval: float = DB_REPLICA_RETRY_INTERVAL,
+        redis_url: Optional[str] = READ_YOUR_WRITES_REDIS_URL,
+    ):
+        self.primary = primary
+        self.replica = replica
+        self.window = window
+        self.retry_interval = retry_interval
+        self._recent_writers = TTLCache(maxsize=100000, ttl=window)
+        self._redis = None
+        self._redis_down_until = 0.0
+        if redis_url and replica is not None:
+            # READ_YOUR_WRITES_REDIS_URL を設定した場合だけ redis パッケージを読み込む
+            import redis.asyncio
+
+            self._redis = redis.asyncio.from_url(redis_url)
+        self._down_until = 0.0
+        self._connecting = False
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.fallbacks = 0
+        self.replica_misses = 0
+        self.shared_errors = 0
+
+    async def connect(self):
+        """
+        Connect the replica, if any. The primary is connected by the caller.
+        """
+        if self.replica is not None:
+            await self._connect_replica()
+
+    async def disconnect(self):
+        if self.replica is not None and self.replica.is_connected:
+            await self.replica.disconnect()
+        if self._redis is not None:
+            await self._redis.close()
+
+    @staticmethod
+    def _markers(sub: Optional[str], table: Optional[str]) -> list:
+        markers = []
+        if sub:
+            markers.append(f"recent_writer:{sub}")
+        if table:
+            markers.append(f"recent_table:{table}")
+        return markers
+
+    async def mark_written(self, sub: Optional[str], table: Optional[str] = None):
+        """
+        Record a write by `sub`, and to the shared listing `table` when the write changes what it returns.
+        """
+        if self.replica is None:
+            return
+        for marker in self._markers(sub, table):
+            self._recent_writers.set(marker, True)
+            if self._redis is not None:
+                try:
+                    await self._redis.set(marker, 1, px=int(self.window * 1000))
+                except Exception as e:
+                    self.shared_errors += 1
+                    logger.warning("Failed to record a recent write in Redis: %s", e)
+
+    async def _wrote_recently(self, markers: list) -> bool:
+        if not markers:
+            return False
+        if any(self._recent_writers.get(marker) is not None for marker in markers):
+            return True
+        if self._redis is None:
+            return False
+        # 他のワーカーでの書き込みを確認できない間は、プライマリから読み込む
+        if time.monotonic() < self._redis_down_until:
+            return True
+        try:
+            return bool(await self._redis.exists(*markers))
+        except Exception as e:
+            self.shared_errors += 1
+            self._redis_down_until = time.monotonic() + self.retry_interval
+            logger.warning("Failed to look up a recent write in Redis: %s", e)
+            return True
+
+    async def _connect_replica(self) -> bool:
+        # 接続中に届いた読み込みは、接続を待たずにプライマリで処理する
+        if self._connecting:
+            return False
+        self._connecting = True
+        try:
+            await self.replica.connect()
+            return True
+        except Exception as e:
+            logger.warning("Read replica is unavailable: %s", e)
+            self._down_until = time.monotonic() + self.retry_interval
+            return False
+        finally:
+            self._connecting = False
+
+    async def _should_use_replica(self, sub: Optional[str], table: Optional[str]) -> bool:
+        if self.replica is None or time.monotonic() < self._down_until:
+            return False
+        return not await self._wrote_recently(self._markers(sub, table))
+
+    async def _read(self, method: str, query, sub: Optional[str], table: Optional[str] = None):
+        if await self._should_use_replica(sub, table) and (self.replica.is_connected or await self._connect_replica()):
+            try:
+                result = await getattr(self.replica, method)(query)
+                self.replica_reads += 1
+                return result, True
+            except PoolExhausted:
+                # 混雑しているだけなので、停止扱いにはせずにプライマリで処理する
+                self.fallbacks += 1
+            except Exception as e:
+                logger.warning("Read replica query failed, falling back to the primary: %s", e)
+                self._down_until = time.monotonic() + self.retry_interval
+                self.fallbacks += 1
+        self.primary_reads += 1
+        return await getattr(self.primary, method)(query), False
+
+    async def fetch_one(self, query, sub: Optional[str] = None):
+        row, from_replica = await self._read("fetch_one", query, sub)
+        if row is None and from_replica:
+            self.replica_misses += 1
+            self.primary_reads += 1
+            row = await self.primary.fetch_one(query)
+        return row
+
+    async def fetch_all(self, query, sub: Optional[str] = None, table: Optional[str] = None):
+        rows, _ = await self._read("fetch_all", query, sub, table)
+        return rows
+
+    def stats(self) -> dict:
+        stats = {
+            "replica_configured": self.replica is not None,
+            "replica_available": self.replica is not None and time.monotonic() >= self._down_until,
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+            "fallbacks": self.fallbacks,
+            "replica_misses": self.replica_misses,
+            "recent_writers": len(self._recent_writers),
+            "shared_recent_writers": self._redis is not None,
+            "shared_errors": self.shared_errors,
+        }
+        if self.replica is not None:
+            stats["replica_pool"] = self.replica.stats()
+        return stats
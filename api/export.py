@@ -0,0 +1,50 @@
+import os
+from typing import AsyncIterator, Optional, Sequence
+
+from databases import Database
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Column
+from sqlalchemy.sql import Select
+
+from serializers import encode_row
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# 1回のクエリで読み込む行数（メモリ使用量の上限はこの値で決まる）
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 1000))
+
+
+def wants_ndjson(request: Request, format: Optional[str]) -> bool:
+    if format is not None:
+        return format == "ndjson"
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+async def iter_rows(database: Database, query: Select, id_column: Column, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator:
+    """
+    Yield every row of `query` in id order, reading one keyset page at a time.
+
+    The MySQL driver buffers a whole result set client-side, so paging on the
+    primary key is what keeps memory bounded by `batch_size`.
+    """
+    last_id = None
+    while True:
+        page = query.order_by(id_column).limit(batch_size)
+        if last_id is not None:
+            page = page.where(id_column > last_id)
+        rows = await database.fetch_all(page)
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1][id_column.name]
+
+
+async def _encode_ndjson(rows: AsyncIterator, fields: Sequence[str]) -> AsyncIterator[bytes]:
+    async for row in rows:
+        yield encode_row(row, fields) + b"\n"
+
+
+def ndjson_response(rows: AsyncIterator, fields: Sequence[str]) -> StreamingResponse:
+    return StreamingResponse(_encode_ndjson(rows, fields), media_type=NDJSON_MEDIA_TYPE)
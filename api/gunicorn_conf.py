@@ -0,0 +1,30 @@
+import multiprocessing
+import os
+
+# gunicornの設定（UvicornWorkerでFastAPIを複数プロセスで実行する）
+#   gunicorn -c gunicorn_conf.py main:app
+
+bind = os.environ.get("BIND", "0.0.0.0:7000")
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# ワーカー数は明示されなければCPUコア数 × WORKERS_PER_CORE（最低2）にする
+# 各ワーカーがDB_POOL_MAX_SIZE本まで接続するため、合計がMySQLのmax_connectionsを超えないようにする
+WORKERS_PER_CORE = float(os.environ.get("WORKERS_PER_CORE", 1))
+workers = int(os.environ.get("WEB_CONCURRENCY", max(int(multiprocessing.cpu_count() * WORKERS_PER_CORE), 2)))
+
+# アプリケーションをマスタープロセスで読み込んでからforkする（メモリを共有し起動を速くする）
+# 有効にするとHUPでコードは再読み込みされないため、コードの更新時はコンテナを再起動する
+preload_app = os.environ.get("PRELOAD_APP", "false").lower() in ("1", "true", "yes")
+
+# HUP / TERM を受けたワーカーは処理中のリクエストを graceful_timeout 秒まで待ってから終了する
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 30))
+timeout = int(os.environ.get("TIMEOUT", 60))
+keepalive = int(os.environ.get("KEEP_ALIVE", 5))
+
+# 一定数のリクエストを処理したワーカーを順に入れ替える（0で無効）
+max_requests = int(os.environ.get("MAX_REQUESTS", 0))
+max_requests_jitter = int(os.environ.get("MAX_REQUESTS_JITTER", 0))
+
+accesslog = os.environ.get("ACCESS_LOG", "-") or None
+errorlog = "-"
+loglevel = os.environ.get("LOG_LEVEL", "info")
@@ -0,0 +1,192 @@
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Tuple
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from metrics import password_hash_duration
+
+# ハッシュ計算を行うワーカーの種類（thread / process）と並列数
+HASH_EXECUTOR = os.environ.get("HASH_EXECUTOR", "thread")
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", os.cpu_count() or 1))
+HASH_MAX_CONCURRENCY = int(os.environ.get("HASH_MAX_CONCURRENCY", HASH_WORKERS))
+# 実行待ちのハッシュ計算の上限（超えた分は429を返す、0で無制限）と、そのときのRetry-After（秒）
+HASH_MAX_QUEUE = int(os.environ.get("HASH_MAX_QUEUE", 0))
+HASH_RETRY_AFTER = int(os.environ.get("HASH_RETRY_AFTER", 1))
+
+# パスワードハッシュの方式（bcrypt / argon2）とコスト（manage.py calibrate-hash で目標の照合時間から決める）
+PASSWORD_HASH_SCHEME = os.environ.get("PASSWORD_HASH_SCHEME", "bcrypt")
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+ARGON2_TIME_COST = int(os.environ.get("ARGON2_TIME_COST", 2))
+ARGON2_MEMORY_COST = int(os.environ.get("ARGON2_MEMORY_COST", 19456))
+ARGON2_PARALLELISM = int(os.environ.get("ARGON2_PARALLELISM", 1))
+
+
+def make_context(
+    scheme: str = PASSWORD_HASH_SCHEME,
+    bcrypt_rounds: int = BCRYPT_ROUNDS,
+    argon2_time_cost: int = ARGON2_TIME_COST,
+    argon2_memory_cost: int = ARGON2_MEMORY_COST,
+    argon2_parallelism: int = ARGON2_PARALLELISM,
+) -> CryptContext:
+    """
+    Hash with `scheme` at the given cost. Hashes of the other scheme or at another cost report needs_update().
+    """
+    if scheme not in ("bcrypt", "argon2"):
+        raise ValueError(f"Unknown password hash scheme: {scheme}")
+    return CryptContext(
+        schemes=["bcrypt", "argon2"],
+        default=scheme,
+        deprecated="auto",
+        bcrypt__rounds=bcrypt_rounds,
+        bcrypt__min_rounds=bcrypt_rounds,
+        bcrypt__max_rounds=bcrypt_rounds,
+        argon2__time_cost=argon2_time_cost,
+        argon2__min_rounds=argon2_time_cost,
+        argon2__max_rounds=argon2_time_cost,
+        argon2__memory_cost=argon2_memory_cost,
+        argon2__parallelism=argon2_parallelism,
+    )
+
+
+# プロセスプールのワーカー側でも同じ設定で生成されるよう、モジュールレベルで定義する
+pwd_context = make_context()
+
+
+class HasherOverloaded(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=429,
+            detail="Server is busy, please retry later",
+            headers={"Retry-After": str(HASH_RETRY_AFTER)},
+        )
+
+
+def hash_cost(hashed_password: str) -> Tuple[str, str]:
+    """
+    Return the scheme of a stored hash and its cost parameters, as used for metric labels.
+    """
+    scheme = pwd_context.identify(hashed_password)
+    if scheme is None:
+        return "unknown", ""
+    try:
+        info = pwd_context.handler(scheme).from_string(hashed_password)
+    except ValueError:
+        return scheme, ""
+    if scheme == "argon2":
+        return scheme, f"t={info.rounds},m={info.memory_cost},p={info.parallelism}"
+    return scheme, str(info.rounds)
+
+
+def needs_update(hashed_password: str) -> bool:
+    return pwd_context.needs_update(hashed_password)
+
+
+# ワーカー側で計算時間を測り、待ち時間を含まないハッシュのコストを記録できるようにする
+def _hash(password: str) -> Tuple[str, float]:
+    started_at = time.perf_counter()
+    hashed_password = pwd_context.hash(password)
+    return hashed_password, time.perf_counter() - started_at
+
+
+def _verify(plain_password: str, hashed_password: str) -> Tuple[bool, float]:
+    started_at = time.perf_counter()
+    verified = pwd_context.verify(plain_password, hashed_password)
+    return verified, time.perf_counter() - started_at
+
+
+class PasswordHasher:
+    """
+    Run password hashing and verification on a bounded worker pool so the event loop stays free.
+    """
+
+    def __init__(
+        self,
+        kind: str = HASH_EXECUTOR,
+        workers: int = HASH_WORKERS,
+        max_concurrency: int = HASH_MAX_CONCURRENCY,
+        max_queue: int = HASH_MAX_QUEUE,
+    ):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown hash executor: {kind}")
+        self.kind = kind
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._executor: Executor = None
+        self._semaphore: asyncio.Semaphore = None
+        self.waiting = 0
+        self.in_flight = 0
+        self.max_waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+
+    def start(self):
+        if self.kind == "process":
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hasher")
+        # Python 3.8 ではセマフォが生成時のイベントループに紐づくため、起動時に生成する
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def _run(self, func, *args):
+        if self._executor is None:
+            self.start()
+        # 待ち行列が上限に達している場合は、待たせずに拒否して他のエンドポイントのCPUを確保する
+        if self.max_queue and self._semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise HasherOverloaded()
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        started_at = time.perf_counter()
+        self.total_wait_seconds += started_at - queued_at
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.total_run_seconds += time.perf_counter() - started_at
+            self._semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        hashed_password, elapsed = await self._run(_hash, password)
+        password_hash_duration.observe(elapsed, "hash", *hash_cost(hashed_password))
+        return hashed_password
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        verified, elapsed = await self._run(_verify, plain_password, hashed_password)
+        password_hash_duration.observe(elapsed, "verify", *hash_cost(hashed_password))
+        return verified
+
+    def stats(self) -> dict:
+        return {
+            "scheme": PASSWORD_HASH_SCHEME,
+            "executor": self.kind,
+            "workers": self.workers,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_depth": self.waiting,
+            "max_queue_depth": self.max_waiting,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "total_wait_seconds": round(self.total_wait_seconds, 6),
+            "total_run_seconds": round(self.total_run_seconds, 6),
+        }
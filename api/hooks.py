@@ -0,0 +1,23 @@
+import logging
+import os
+
+import httpx
+
+# 投稿の作成・削除時にフロントエンドのタイムラインキャッシュを無効化する通知先と共有トークン
+FRONTEND_INVALIDATE_URL = os.environ.get("FRONTEND_INVALIDATE_URL")
+CACHE_INVALIDATION_TOKEN = os.environ.get("CACHE_INVALIDATION_TOKEN", "")
+
+logger = logging.getLogger(__name__)
+
+
+async def notify_posts_changed():
+    """
+    Tell the frontend to drop its cached timeline. Failures are only logged; the cache TTL bounds staleness.
+    """
+    if not FRONTEND_INVALIDATE_URL:
+        return
+    try:
+        async with httpx.AsyncClient(timeout=2.0) as client:
+            await client.post(FRONTEND_INVALIDATE_URL, headers={"X-Invalidation-Token": CACHE_INVALIDATION_TOKEN})
+    except httpx.HTTPError as e:
+        logger.warning("Failed to notify %s: %s", FRONTEND_INVALIDATE_URL, e)
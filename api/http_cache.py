@@ -0,0 +1,48 @@
+import hashlib
+import os
+from typing import Any, Optional, Sequence
+
+from fastapi import Request, Response
+
+from serializers import json_response
+
+# 公開リソースを共有キャッシュ（CDNなど）で再利用してよい時間（秒）
+PUBLIC_CACHE_MAX_AGE = int(os.environ.get("PUBLIC_CACHE_MAX_AGE", 10))
+
+# 誰が取得しても同じ内容のリソース
+PUBLIC = f"public, max-age={PUBLIC_CACHE_MAX_AGE}"
+# 利用者ごとに内容や閲覧可否が異なるリソース（共有キャッシュには保存させず、毎回再検証させる）
+PRIVATE = "private, no-cache"
+
+
+def compute_etag(body: bytes) -> str:
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match は弱い比較で判定する
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+
+def cached_json_response(request: Request, content: Any, fields: Sequence[str], cache_control: str, headers: Optional[dict] = None) -> Response:
+    """
+    Serialize `content` to JSON with an ETag over the body, answering 304 when the client already has it.
+    """
+    response_headers = {"Cache-Control": cache_control}
+    if cache_control == PRIVATE:
+        response_headers["Vary"] = "Authorization"
+    if headers:
+        response_headers.update(headers)
+
+    response = json_response(content, fields, headers=response_headers)
+    etag = compute_etag(response.body)
+    response.headers["ETag"] = etag
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={**response_headers, "ETag": etag})
+    return response
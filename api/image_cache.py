@@ -0,0 +1,281 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from typing import Optional, Union
+
+import httpx
+
+from cache import TTLCache
+from image_proxy import ImageClient
+
+# メモリ上に保持する画像の件数、1件あたりの最大サイズ（バイト）
+IMAGE_CACHE_SIZE = int(os.environ.get("IMAGE_CACHE_SIZE", 256))
+IMAGE_CACHE_MAX_ENTRY_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_ENTRY_BYTES", 1024 * 1024))
+# ディスク上のキャッシュの保存先（空文字でディスクキャッシュを無効化）と合計サイズの上限（バイト）
+IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "image_cache"))
+IMAGE_CACHE_DISK_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_DISK_MAX_BYTES", 256 * 1024 * 1024))
+# 取得元がmax-ageを指定しない場合に再検証なしで使い回す時間（秒）
+IMAGE_CACHE_FRESH_SECONDS = float(os.environ.get("IMAGE_CACHE_FRESH_SECONDS", 300))
+# 期限切れのエントリを再検証用に保持する時間（秒）
+IMAGE_CACHE_RETAIN_SECONDS = float(os.environ.get("IMAGE_CACHE_RETAIN_SECONDS", 24 * 60 * 60))
+
+logger = logging.getLogger(__name__)
+
+_MAX_AGE = re.compile(r"(?:^|,)\s*(?:s-maxage|max-age)\s*=\s*(\d+)")
+
+
+def freshness_lifetime(headers: httpx.Headers) -> Optional[float]:
+    """
+    Return how long a response may be reused without revalidation, or None if it must not be stored.
+    """
+    cache_control = headers.get("Cache-Control", "").lower()
+    directives = {item.split("=", 1)[0].strip() for item in cache_control.split(",")}
+    # 全ユーザーで共有するキャッシュのため、特定のユーザー向けの応答（private）も保存しない
+    if "no-store" in directives or "private" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0.0
+    match = _MAX_AGE.search(cache_control)
+    if match:
+        return float(match.group(1))
+    return IMAGE_CACHE_FRESH_SECONDS
+
+
+class CachedImage:
+    def __init__(self, url: str, body: bytes, content_type: str, etag: Optional[str], last_modified: Optional[str], expires_at: float, digest: str = None):
+        self.url = url
+        self.body = body
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+        self.digest = digest or hashlib.sha256(body).hexdigest()
+        # ディスク上のメタデータの版（inode番号と更新時刻）。他のワーカーによる更新・無効化の検出に使う
+        self.meta_version: Optional[tuple] = None
+
+    @property
+    def client_etag(self) -> str:
+        # 自サービスのクライアントには内容のハッシュをETagとして返す
+        return f'"{self.digest[:32]}"'
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+    def conditional_headers(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def to_meta(self) -> dict:
+        return {
+            "url": self.url,
+            "digest": self.digest,
+            "content_type": self.content_type,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "expires_at": self.expires_at,
+        }
+
+
+class ImageCache:
+    """
+    Two-tier cache for remote images keyed by URL: an in-memory LRU in front of a
+    content-addressed on-disk store (blobs named by the SHA-256 of their bytes).
+
+    The disk store is shared by the workers, so a memory hit is checked against the
+    entry's metadata file and dropped once another worker rewrote or invalidated it.
+    Without the disk store, other workers keep their copy until it has to be revalidated.
+    """
+
+    def __init__(self, directory: str = IMAGE_CACHE_DIR):
+        self.memory = TTLCache(maxsize=IMAGE_CACHE_SIZE, ttl=IMAGE_CACHE_RETAIN_SECONDS)
+        self.directory = directory
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self.stale_memory = 0
+        self.revalidations = 0
+        self.not_modified = 0
+        self.stores = 0
+        if directory:
+            try:
+                os.makedirs(os.path.join(directory, "blobs"), exist_ok=True)
+                os.makedirs(os.path.join(directory, "meta"), exist_ok=True)
+            except OSError as e:
+                logger.warning("Disabling on-disk image cache at %s: %s", directory, e)
+                self.directory = ""
+
+    def _meta_path(self, url: str) -> str:
+        return os.path.join(self.directory, "meta", hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "blobs", digest)
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _load_from_disk(self, url: str) -> Optional[CachedImage]:
+        try:
+            with open(self._meta_path(url)) as f:
+                meta = json.load(f)
+                stat = os.fstat(f.fileno())
+            with open(self._blob_path(meta["digest"]), "rb") as f:
+                body = f.read()
+        except (OSError, ValueError, KeyError):
+            return None
+        if meta.get("url") != url or meta.get("expires_at", 0) + IMAGE_CACHE_RETAIN_SECONDS < time.time():
+            return None
+        entry = CachedImage(url, body, meta["content_type"], meta["etag"], meta["last_modified"], meta["expires_at"], digest=meta["digest"])
+        entry.meta_version = (stat.st_ino, stat.st_mtime_ns)
+        return entry
+
+    def _meta_version(self, url: str) -> Optional[tuple]:
+        # メタデータは置き換えで書き込むため、書き込むたびにinodeが変わる
+        try:
+            stat = os.stat(self._meta_path(url))
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _save_to_disk(self, entry: CachedImage, write_blob: bool):
+        try:
+            if write_blob and not os.path.exists(self._blob_path(entry.digest)):
+                self._write_atomic(self._blob_path(entry.digest), entry.body)
+                self._prune()
+            self._write_atomic(self._meta_path(entry.url), json.dumps(entry.to_meta()).encode())
+            entry.meta_version = self._meta_version(entry.url)
+        except OSError as e:
+            logger.warning("Failed to write image cache entry for %s: %s", entry.url, e)
+
+    def _prune(self):
+        # 合計サイズが上限を超えたら、更新の古いblobから削除する（対応するメタデータは読み込み時にミスとして扱われる）
+        blob_dir = os.path.join(self.directory, "blobs")
+        blobs = []
+        for name in os.listdir(blob_dir):
+            try:
+                stat = os.stat(os.path.join(blob_dir, name))
+            except OSError:
+                continue
+            blobs.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in blobs)
+        for _, size, name in sorted(blobs):
+            if total <= IMAGE_CACHE_DISK_MAX_BYTES:
+                break
+            try:
+                os.remove(os.path.join(blob_dir, name))
+            except OSError:
+                pass
+            total -= size
+
+    async def _run_io(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+    async def get(self, url: str) -> Optional[CachedImage]:
+        entry = self.memory.get(url)
+        if entry is not None and (not self.directory or entry.meta_version is None):
+            return entry
+        if not self.directory:
+            return None
+        if entry is not None:
+            # メタデータのstatだけなのでイベントループ上で行う。変わっていなければメモリ上の内容を使う
+            meta_version = self._meta_version(url)
+            if meta_version == entry.meta_version:
+                return entry
+            self.memory.invalidate(url)
+            self.stale_memory += 1
+            if meta_version is None:
+                # 他のワーカーが無効化した
+                self.disk_misses += 1
+                return None
+        entry = await self._run_io(self._load_from_disk, url)
+        if entry is None:
+            self.disk_misses += 1
+            return None
+        self.disk_hits += 1
+        self.memory.set(url, entry)
+        return entry
+
+    async def put(self, entry: CachedImage, write_blob: bool = True):
+        self.memory.set(entry.url, entry)
+        if self.directory:
+            await self._run_io(self._save_to_disk, entry, write_blob)
+
+    async def invalidate(self, url: str):
+        self.memory.invalidate(url)
+        if self.directory:
+            try:
+                await self._run_io(os.remove, self._meta_path(url))
+            except OSError:
+                pass
+
+    async def fetch(self, client: ImageClient, url: str) -> Union[CachedImage, httpx.Response]:
+        """
+        Return the image for `url` from the cache, revalidating it with the origin when stale.
+
+        Responses that cannot be cached (too large, unknown length, no-store or private) are returned
+        as an open streaming `httpx.Response` for the caller to relay.
+        """
+        cached = await self.get(url)
+        if cached is not None and cached.is_fresh():
+            return cached
+
+        headers = cached.conditional_headers() if cached is not None else None
+        if cached is not None:
+            self.revalidations += 1
+        response = await client.open(url, headers=headers)
+        lifetime = freshness_lifetime(response.headers)
+
+        if response.status_code == 304:
+            await client.read(response)
+            self.not_modified += 1
+            if lifetime is None:
+                # 取得元が保存を許可しなくなった場合は、今回だけ使ってキャッシュから削除する
+                await self.invalidate(url)
+                return cached
+            cached.expires_at = time.time() + (lifetime or 0.0)
+            cached.etag = response.headers.get("ETag", cached.etag)
+            cached.last_modified = response.headers.get("Last-Modified", cached.last_modified)
+            await self.put(cached, write_blob=False)
+            return cached
+
+        content_length = response.headers.get("Content-Length", "")
+        if lifetime is None or not content_length.isdigit() or int(content_length) > IMAGE_CACHE_MAX_ENTRY_BYTES:
+            return response
+
+        body = await client.read(response)
+        entry = CachedImage(
+            url,
+            body,
+            response.headers.get("Content-Type", "application/octet-stream"),
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+            time.time() + lifetime,
+        )
+        if len(body) <= IMAGE_CACHE_MAX_ENTRY_BYTES:
+            self.stores += 1
+            await self.put(entry)
+        return entry
+
+    def stats(self) -> dict:
+        return {
+            "memory": self.memory.stats(),
+            "disk_enabled": bool(self.directory),
+            "disk_hits": self.disk_hits,
+            "disk_misses": self.disk_misses,
+            "stale_memory": self.stale_memory,
+            "revalidations": self.revalidations,
+            "not_modified": self.not_modified,
+            "stores": self.stores,
+        }
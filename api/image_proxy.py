@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import os
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+import httpx
+
+# 画像取得の上限サイズ（バイト）、最初のレスポンスまでの待ち時間（秒）、転送時のチャンクサイズ（バイト）
+IMAGE_MAX_BYTES = int(os.environ.get("IMAGE_MAX_BYTES", 10 * 1024 * 1024))
+IMAGE_TTFB_TIMEOUT = float(os.environ.get("IMAGE_TTFB_TIMEOUT", 5.0))
+IMAGE_CHUNK_SIZE = int(os.environ.get("IMAGE_CHUNK_SIZE", 64 * 1024))
+IMAGE_FETCH_TIMEOUT = float(os.environ.get("IMAGE_FETCH_TIMEOUT", 10.0))
+
+# 画像取得用コネクションプールの設定
+IMAGE_POOL_MAX_CONNECTIONS = int(os.environ.get("IMAGE_POOL_MAX_CONNECTIONS", 100))
+IMAGE_POOL_MAX_KEEPALIVE = int(os.environ.get("IMAGE_POOL_MAX_KEEPALIVE", 20))
+IMAGE_POOL_KEEPALIVE_EXPIRY = float(os.environ.get("IMAGE_POOL_KEEPALIVE_EXPIRY", 30.0))
+IMAGE_POOL_MAX_PER_HOST = int(os.environ.get("IMAGE_POOL_MAX_PER_HOST", 10))
+IMAGE_HTTP2 = os.environ.get("IMAGE_HTTP2", "false").lower() in ("1", "true", "yes")
+
+logger = logging.getLogger(__name__)
+
+
+class ImageFetchError(Exception):
+    pass
+
+
+async def open_image(client: httpx.AsyncClient, url: str, headers: Optional[dict] = None) -> httpx.Response:
+    """
+    Send a streaming GET for `url` and return the response once its headers have arrived.
+
+    The body is not read here; the caller must consume it with `iter_image`.
+    A 304 is accepted only when conditional `headers` were sent.
+    """
+    request = client.build_request("GET", url, headers=headers)
+    try:
+        response = await asyncio.wait_for(client.send(request, stream=True), timeout=IMAGE_TTFB_TIMEOUT)
+    except (httpx.HTTPError, asyncio.TimeoutError) as e:
+        raise ImageFetchError(f"Failed to fetch {url}") from e
+
+    if response.status_code != 200 and not (headers and response.status_code == 304):
+        await response.aclose()
+        raise ImageFetchError(f"Unexpected status {response.status_code} from {url}")
+
+    content_length = response.headers.get("Content-Length")
+    if content_length and content_length.isdigit() and int(content_length) > IMAGE_MAX_BYTES:
+        await response.aclose()
+        raise ImageFetchError(f"Image too large ({content_length} bytes) at {url}")
+    return response
+
+
+async def iter_image(response: httpx.Response, on_close: Optional[Callable[[], Awaitable[None]]] = None) -> AsyncIterator[bytes]:
+    received = 0
+    try:
+        async for chunk in response.aiter_bytes(IMAGE_CHUNK_SIZE):
+            received += len(chunk)
+            if received > IMAGE_MAX_BYTES:
+                # ヘッダーは送信済みのためステータスは変更できない。接続を打ち切り、不完全な画像を正常終了させない
+                logger.warning("Image at %s exceeded %d bytes, aborting", response.request.url, IMAGE_MAX_BYTES)
+                raise ImageFetchError("Image too large")
+            yield chunk
+    finally:
+        await response.aclose()
+        if on_close is not None:
+            await on_close()
+
+
+class ImageClient:
+    """
+    Application-scoped httpx client for image fetches, with a per-host cap on concurrent requests.
+    """
+
+    def __init__(self):
+        self.client: httpx.AsyncClient = None
+        self._host_semaphores = {}
+        self._host_users = {}
+        self.requests = 0
+        self.in_flight = 0
+
+    def start(self):
+        limits = httpx.Limits(
+            max_connections=IMAGE_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=IMAGE_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=IMAGE_POOL_KEEPALIVE_EXPIRY,
+        )
+        self.client = httpx.AsyncClient(timeout=IMAGE_FETCH_TIMEOUT, limits=limits, http2=IMAGE_HTTP2)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def _acquire_host(self, host: str):
+        # 待機中と実行中のリクエスト数を数え、誰も使っていないホストのセマフォは破棄する
+        self._host_users[host] = self._host_users.get(host, 0) + 1
+        semaphore = self._host_semaphores.setdefault(host, asyncio.Semaphore(IMAGE_POOL_MAX_PER_HOST))
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=IMAGE_TTFB_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._forget_host(host)
+            raise ImageFetchError(f"Too many concurrent requests to {host}")
+
+    def _release_host(self, host: str):
+        self._host_semaphores[host].release()
+        self._forget_host(host)
+
+    def _forget_host(self, host: str):
+        self._host_users[host] -= 1
+        if self._host_users[host] == 0:
+            del self._host_users[host]
+            del self._host_semaphores[host]
+
+    async def open(self, url: str, headers: Optional[dict] = None) -> httpx.Response:
+        if self.client is None:
+            self.start()
+        try:
+            host = httpx.URL(url).netloc.decode()
+        except Exception as e:
+            raise ImageFetchError(f"Invalid URL {url}") from e
+        await self._acquire_host(host)
+        try:
+            response = await open_image(self.client, url, headers=headers)
+        except Exception:
+            self._release_host(host)
+            raise
+        self.requests += 1
+        self.in_flight += 1
+        response.extensions["image_host"] = host
+        return response
+
+    def iter(self, response: httpx.Response) -> AsyncIterator[bytes]:
+        async def release():
+            self.in_flight -= 1
+            self._release_host(response.extensions["image_host"])
+
+        return iter_image(response, on_close=release)
+
+    async def read(self, response: httpx.Response) -> bytes:
+        return b"".join([chunk async for chunk in self.iter(response)])
+
+    def stats(self) -> dict:
+        connections = []
+        pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+        if pool is not None:
+            connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "in_flight_by_host": dict(self._host_users),
+            "pool_connections": len(connections),
+            "pool_idle_connections": idle,
+            "pool_max_connections": IMAGE_POOL_MAX_CONNECTIONS,
+            "pool_max_keepalive": IMAGE_POOL_MAX_KEEPALIVE,
+            "max_per_host": IMAGE_POOL_MAX_PER_HOST,
+        }
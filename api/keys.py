@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import secrets
+import tempfile
+import time
+from typing import Dict, Optional, Tuple
+
+from jose import JWTError, jwt
+
+ALGORITHM = "HS256"
+
+# 署名鍵（"kid:secret" をカンマ区切りで指定し、先頭の鍵で署名する）
+JWT_KEYS = os.environ.get("JWT_KEYS")
+# 署名鍵のファイル（JSON）。存在しない場合は新しい鍵を生成して作成し、全ワーカー・再起動後で共有する
+JWT_KEYS_FILE = os.environ.get("JWT_KEYS_FILE")
+# 鍵ファイルの更新（manage.py rotate-key）を確認する間隔（秒）
+JWT_KEYS_RELOAD_INTERVAL = float(os.environ.get("JWT_KEYS_RELOAD_INTERVAL", 30))
+# 未知のkidのトークンを受け取った際に鍵ファイルを確認し直す最短の間隔（秒）。偽造トークンでファイルの確認が繰り返されないようにする
+JWT_KEYS_MIN_RELOAD_INTERVAL = float(os.environ.get("JWT_KEYS_MIN_RELOAD_INTERVAL", 1))
+
+logger = logging.getLogger(__name__)
+
+
+def generate_key() -> Tuple[str, str]:
+    kid = time.strftime("%Y%m%d%H%M%S") + "-" + secrets.token_hex(2)
+    return kid, secrets.token_hex(32)
+
+
+def parse_keys(value: str) -> Tuple[str, Dict[str, str]]:
+    keys = {}
+    for item in value.split(","):
+        kid, _, secret = item.strip().partition(":")
+        if not kid or not secret:
+            raise ValueError("JWT_KEYS must be a comma-separated list of kid:secret pairs")
+        keys[kid] = secret
+    return next(iter(keys)), keys
+
+
+def read_key_file(path: str) -> Tuple[str, Dict[str, str]]:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if data["active"] not in data["keys"]:
+        raise ValueError(f"Active key {data['active']} is missing from {path}")
+    return data["active"], data["keys"]
+
+
+def write_key_file(path: str, active: str, keys: Dict[str, str], exclusive: bool = False):
+    """
+    Atomically write the key file. With `exclusive`, fail with FileExistsError if another process created it first.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".jwt_keys.")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"active": active, "keys": keys}, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        if exclusive:
+            os.link(tmp_path, path)
+        else:
+            os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class KeyStore:
+    """
+    JWT signing keys shared by every worker: tokens carry a `kid` header, the active key signs and
+    every listed key verifies, so keys can be rotated without logging everyone out.
+    """
+
+    def __init__(self, value: Optional[str] = JWT_KEYS, path: Optional[str] = JWT_KEYS_FILE, algorithm: str = ALGORITHM):
+        self.value = value
+        self.path = path
+        self.algorithm = algorithm
+        self.active_kid: str = None
+        self.keys: Dict[str, str] = {}
+        self._mtime = None
+        self._checked_at = 0.0
+        self.load()
+
+    @property
+    def source(self) -> str:
+        if self.value:
+            return "env"
+        return "file" if self.path else "ephemeral"
+
+    def load(self):
+        if self.value:
+            self.active_kid, self.keys = parse_keys(self.value)
+        elif self.path:
+            if not os.path.exists(self.path):
+                kid, secret = generate_key()
+                try:
+                    write_key_file(self.path, kid, {kid: secret}, exclusive=True)
+                    logger.info("Created signing key %s in %s", kid, self.path)
+                except FileExistsError:
+                    # 他のワーカーが先に作成した場合はそちらを使う
+                    pass
+            self._mtime = os.stat(self.path).st_mtime
+            self.active_kid, self.keys = read_key_file(self.path)
+        else:
+            # 設定がない場合は従来どおり起動ごとに生成する（再起動やワーカー間でトークンは共有されない）
+            logger.warning("JWT_KEYS and JWT_KEYS_FILE are not set; using an ephemeral signing key")
+            self.active_kid, secret = generate_key()
+            self.keys = {self.active_kid: secret}
+        self._checked_at = time.monotonic()
+
+    def _reload_if_changed(self, force: bool = False):
+        if not self.path or self.value:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < (JWT_KEYS_MIN_RELOAD_INTERVAL if force else JWT_KEYS_RELOAD_INTERVAL):
+            return
+        self._checked_at = now
+        try:
+            if os.stat(self.path).st_mtime != self._mtime:
+                self.load()
+                logger.info("Reloaded signing keys from %s (active %s)", self.path, self.active_kid)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Failed to reload signing keys from %s: %s", self.path, e)
+
+    def encode(self, claims: dict) -> str:
+        self._reload_if_changed()
+        return jwt.encode(claims, self.keys[self.active_kid], algorithm=self.algorithm, headers={"kid": self.active_kid})
+
+    def decode(self, token: str) -> dict:
+        """
+        Verify `token` with the key named by its `kid` header. Raises JWTError if it cannot be verified.
+        """
+        self._reload_if_changed()
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid is None:
+            # kidのない古いトークンは、登録されているいずれかの鍵で検証できれば受け付ける
+            error = JWTError("Signature verification failed")
+            for secret in self.keys.values():
+                try:
+                    return jwt.decode(token, secret, algorithms=[self.algorithm])
+                except JWTError as e:
+                    error = e
+            raise error
+        if kid not in self.keys:
+            # 他のプロセスがローテーションした直後の可能性があるため、鍵ファイルを確認し直す
+            self._reload_if_changed(force=True)
+        secret = self.keys.get(kid)
+        if secret is None:
+            raise JWTError(f"Unknown key id: {kid}")
+        return jwt.decode(token, secret, algorithms=[self.algorithm])
+
+    def stats(self) -> dict:
+        return {"source": self.source, "active_kid": self.active_kid, "kids": list(self.keys)}
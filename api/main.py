@@ -1,30 +1,60 @@
-from fastapi import FastAPI, Request, HTTPException, Depends, status
+from fastapi import FastAPI, Request, Response, HTTPException, Depends, BackgroundTasks, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.responses import StreamingResponse, FileResponse
-from io import BytesIO
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime, timedelta
-from passlib.context import CryptContext
 from sqlalchemy.orm import Session
-from databases import Database
+from db import PooledDatabase, ReadRouter, consecutive_insert_ids, is_integrity_error
 from models import Base, User, Post
-from jose import JWTError, jwt
-import secrets
+from hashing import HasherOverloaded, PasswordHasher, needs_update
+from cache import TTLCache
+from pagination import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor, clamp_limit
+from export import wants_ndjson, iter_rows, ndjson_response
+from image_proxy import ImageClient
+from image_cache import ImageCache
+from hooks import notify_posts_changed
+from http_cache import PUBLIC, PRIVATE, cached_json_response
+from serializers import json_response
+from metrics import MetricsMiddleware, render as render_metrics, timed
+from profiler import PROFILER_ENABLED, PROFILER_INTERVAL, PROFILER_MAX_SECONDS, ProfilerBusy, profiler
+from keys import KeyStore
+from ratelimit import RateLimiter
+from jose import JWTError
+import logging
 import os
-import httpx
 import uuid
+import httpx
 from urllib.parse import urlparse
 
 app = FastAPI()
+logger = logging.getLogger(__name__)
+app.add_middleware(MetricsMiddleware)
 
-# Generate a random 128-bit SECRET_KEY
-SECRET_KEY = secrets.token_hex(16)
-ALGORITHM = "HS256"
+# JWTの署名鍵（JWT_KEYS または JWT_KEYS_FILE から読み込み、全ワーカーで共有する）
+signing_keys = KeyStore()
 ACCESS_TOKEN_EXPIRE_MINUTES = 600
 
+# トークンにユーザーID・ユーザー名・ロールを埋め込み、認証時のDB参照を省略する
+# アクセストークンは短命にし、ロールの変更はリフレッシュ時に反映される
+STATELESS_TOKENS = os.environ.get("STATELESS_TOKENS", "false").lower() in ("1", "true", "yes")
+STATELESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("STATELESS_TOKEN_EXPIRE_MINUTES", 5))
+REFRESH_TOKEN_EXPIRE_MINUTES = int(os.environ.get("REFRESH_TOKEN_EXPIRE_MINUTES", ACCESS_TOKEN_EXPIRE_MINUTES))
+
+# 一括投稿で1回に作成できる投稿数の上限
+POST_BATCH_MAX_SIZE = int(os.environ.get("POST_BATCH_MAX_SIZE", 500))
+
+# ユーザー名の重複を禁止し、ログイン時は1行だけを照合する（既存の重複は manage.py dedupe-usernames で解消する）
+UNIQUE_USERNAMES = os.environ.get("UNIQUE_USERNAMES", "false").lower() in ("1", "true", "yes")
+
+# ログイン時に、現在の方式・コスト（PASSWORD_HASH_SCHEME・BCRYPT_ROUNDSなど）と異なるハッシュをバックグラウンドで更新する
+PASSWORD_REHASH_ON_LOGIN = os.environ.get("PASSWORD_REHASH_ON_LOGIN", "true").lower() in ("1", "true", "yes")
+
 DATABASE_URL = os.environ.get("DATABASE_URL")
-database = Database(DATABASE_URL)
+database = PooledDatabase(DATABASE_URL)
+# 読み込み専用のハンドラはレプリカ（DATABASE_READ_URL）を優先して使う
+DATABASE_READ_URL = os.environ.get("DATABASE_READ_URL")
+read_router = ReadRouter(database, PooledDatabase(DATABASE_READ_URL, name="replica") if DATABASE_READ_URL else None)
 metadata = Base.metadata
 
 # FLAG
@@ -35,7 +65,17 @@ BOLA_FLAG2 = os.environ.get("BOLA_FLAG2")
 SSRF_FLAG1 = os.environ.get("SSRF_FLAG1")
 SSRF_FLAG2 = os.environ.get("SSRF_FLAG2")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+hasher = PasswordHasher()
+# ログイン・ユーザー登録の試行回数をクライアントIPとユーザー名ごとに制限する（RATE_LIMIT_ENABLED）
+rate_limiter = RateLimiter()
+image_client = ImageClient()
+image_cache = ImageCache()
+
+# 認証済みユーザー（ID・ユーザー名・ロール）のキャッシュ（subをキーとする）
+# 無効化は書き込みを処理したワーカーでしか行われないため、他のワーカーではロールの変更などが最大でTTLの間反映されない
+PRINCIPAL_CACHE_SIZE = int(os.environ.get("PRINCIPAL_CACHE_SIZE", 10000))
+PRINCIPAL_CACHE_TTL = float(os.environ.get("PRINCIPAL_CACHE_TTL", 5))
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="user/login/")
 
 class UserIn(BaseModel):
@@ -64,18 +104,48 @@ class PostOut(BaseModel):
     username: str
     is_private: bool
 
+# 高速な応答経路（FAST_JSON）で出力する項目。パスワードハッシュとsubを除き、各エンドポイントが従来返していた項目と一致させる
+POST_FIELDS = tuple(PostOut.__fields__)
+USER_PROFILE_FIELDS = tuple(UserProfile.__fields__)
+USER_PUBLIC_FIELDS = tuple(column.name for column in User.__table__.columns if column.name not in ("hashed_password", "sub"))
+
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class TokenRefresh(BaseModel):
+    refresh_token: str
 
 class TokenData(BaseModel):
     sub: str
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+# 認証済みユーザー（ステートレスなトークンのクレーム、またはユーザーの行から作る）
+class Principal(BaseModel):
+    id: int
+    sub: str
+    username: str
+    role: str
+
+# パスワードハッシュはCPUを占有するため、イベントループを塞がないようワーカープールで実行する
+async def get_password_hash(password: str) -> str:
+    with timed("password_hash"):
+        return await hasher.hash(password)
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    with timed("password_hash"):
+        return await hasher.verify(plain_password, hashed_password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+# 照合できたパスワードを現在の方式・コストでハッシュ化し直す
+async def rehash_password(user_id: int, old_hash: str, password: str):
+    try:
+        new_hash = await get_password_hash(password)
+    except HasherOverloaded:
+        # 混雑時は見送り、次回のログインで再度行う
+        return
+    # 同時にパスワードが変更されていた場合は上書きしない
+    query = User.__table__.update().where(User.id == user_id).where(User.hashed_password == old_hash).values(hashed_password=new_hash)
+    await database.execute(query)
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
@@ -84,9 +154,28 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = signing_keys.encode(to_encode)
     return encoded_jwt
 
+def issue_tokens(user) -> dict:
+    """
+    Build the login response for `user`, a row with id, sub, username and role.
+    """
+    if not STATELESS_TOKENS:
+        access_token = create_access_token(
+            data={"sub": user.sub}, expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        )
+        return {"access_token": access_token, "token_type": "bearer"}
+
+    access_token = create_access_token(
+        data={"sub": user.sub, "uid": user.id, "username": user.username, "role": user.role, "typ": "access"},
+        expires_delta=timedelta(minutes=STATELESS_TOKEN_EXPIRE_MINUTES),
+    )
+    refresh_token = create_access_token(
+        data={"sub": user.sub, "typ": "refresh"}, expires_delta=timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES)
+    )
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     if not token:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="No access token provided")
@@ -97,18 +186,39 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with timed("jwt_decode"):
+            payload = signing_keys.decode(token)
         sub: str = payload.get("sub")
-        if sub is None:
+        if sub is None or payload.get("typ") == "refresh":
             raise credentials_exception
         token_data = TokenData(sub=sub)
     except JWTError:
         raise credentials_exception
 
+    # クレームを持つトークンは署名の検証だけで信用し、DBを参照しない
+    if STATELESS_TOKENS and "uid" in payload:
+        return Principal(id=payload["uid"], sub=sub, username=payload["username"], role=payload["role"])
+
+    user = principal_cache.get(token_data.sub)
+    if user is not None:
+        return user
+
     query = User.__table__.select().where(User.sub == token_data.sub)
-    user = await database.fetch_one(query)
+    with timed("auth_lookup"):
+        user = await read_router.fetch_one(query, sub=token_data.sub)
     if user is None:
         raise credentials_exception
+    # 画像URLなど変更される項目はキャッシュせず、必要なハンドラが読み込み直す
+    principal = Principal(id=user.id, sub=user.sub, username=user.username, role=user.role)
+    principal_cache.set(token_data.sub, principal)
+    return principal
+
+# 認証済みユーザーにない項目が必要なハンドラは、ユーザーの行をプライマリから読み込む
+async def load_user_row(current_user):
+    query = User.__table__.select().where(User.id == current_user.id)
+    user = await database.fetch_one(query)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
     return user
 
 # 有効なURLであるかどうかを検証
@@ -128,11 +238,21 @@ def is_not_localhost(hostname: str) -> bool:
 
 @app.on_event("startup")
 async def startup():
+    hasher.start()
+    image_client.start()
     await database.connect()
+    await read_router.connect()
+    # 一括投稿で、複数行INSERTが返すidから各行のidを求められるかを確認する
+    app.state.consecutive_insert_ids = await consecutive_insert_ids(database)
+    if not app.state.consecutive_insert_ids:
+        logger.warning("Multi-row INSERT ids may not be consecutive; /post/batch inserts rows one by one in a transaction")
 
 @app.on_event("shutdown")
 async def shutdown():
+    await read_router.disconnect()
     await database.disconnect()
+    await image_client.close()
+    hasher.shutdown()
 
 # ユーザー用API
 ## ヘルスチェック
@@ -142,49 +262,88 @@ def healthcheck():
 
 ## ユーザー登録
 @app.post("/user/register", tags=["user"], status_code=201)
-async def register(user: UserIn):
-    # 既に同じユーザー名が存在する場合、エラーを投げる
-    # query = User.__table__.select().where(User.username == user.username)
-    # existing_user = await database.fetch_one(query)
-    # if existing_user:
-    #     raise HTTPException(status_code=400, detail="Username already exists.")
-    
+async def register(request: Request, user: UserIn):
+    # パスワードのハッシュ化の前に試行回数を制限する
+    await rate_limiter.check("register", request, user.username)
+
+    # 既に同じユーザー名が存在する場合、エラーを投げる（パスワードのハッシュ化を行う前に確認する）
+    if UNIQUE_USERNAMES:
+        query = User.__table__.select().with_only_columns([User.id]).where(User.username == user.username).limit(1)
+        existing_user = await database.fetch_one(query)
+        if existing_user:
+            raise HTTPException(status_code=400, detail="Username already exists.")
+
     # パスワードをハッシュ化してデータベースに保存
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     query = User.__table__.insert().values(username=user.username, hashed_password=hashed_password, sub=str(uuid.uuid4()))
-    user_id = await database.execute(query)
+    try:
+        user_id = await database.execute(query)
+    except Exception as e:
+        # 確認の後に同じユーザー名で登録された場合は、ユニークインデックス（api/migrations/0003）の違反になる
+        if is_integrity_error(e):
+            raise HTTPException(status_code=400, detail="Username already exists.")
+        raise
     return {"id": user_id, "username": user.username}
 
 ## ログイン
-@app.post("/user/login", tags=["user"], response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    query = User.__table__.select().where(User.username == form_data.username)
+@app.post("/user/login", tags=["user"], response_model=Token, response_model_exclude_none=True)
+async def login(request: Request, background_tasks: BackgroundTasks, form_data: OAuth2PasswordRequestForm = Depends()):
+    # DBの参照とパスワードの照合の前に試行回数を制限する
+    await rate_limiter.check("login", request, form_data.username)
+
+    # usernameのインデックスを使って照合とトークンの発行に必要な列だけを取得する
+    query = User.__table__.select().with_only_columns([User.id, User.sub, User.username, User.role, User.hashed_password]).where(User.username == form_data.username).order_by(User.id)
+    if UNIQUE_USERNAMES:
+        query = query.limit(1)
     users = await database.fetch_all(query)
 
+    # 各行のハッシュ照合は高々1回だけ行う
     user = None
     for potential_user in users:
-        if verify_password(form_data.password, potential_user.hashed_password):
+        if await verify_password(form_data.password, potential_user.hashed_password):
             user = potential_user
             break
 
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.sub }, expires_delta=access_token_expires
+    # 応答を返した後にハッシュを更新し、ログインの応答時間には含めない
+    if PASSWORD_REHASH_ON_LOGIN and needs_update(user.hashed_password):
+        background_tasks.add_task(rehash_password, user.id, user.hashed_password, form_data.password)
+
+    return issue_tokens(user)
+
+## アクセストークンの再発行
+## ユーザーを読み込み直すため、ロールの変更はここで新しいトークンに反映される
+@app.post("/user/token/refresh", tags=["user"], response_model=Token, response_model_exclude_none=True)
+async def refresh_token(data: TokenRefresh):
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+    try:
+        payload = signing_keys.decode(data.refresh_token)
+    except JWTError:
+        raise credentials_exception
+    if payload.get("typ") != "refresh" or payload.get("sub") is None:
+        raise credentials_exception
+
+    query = User.__table__.select().with_only_columns([User.id, User.sub, User.username, User.role]).where(User.sub == payload["sub"])
+    user = await database.fetch_one(query)
+    if user is None:
+        raise credentials_exception
+    return issue_tokens(user)
 
 ## ユーザーのプロファイル情報を取得
 @app.get("/user/profile", tags=["user"])
-async def get_user_profile(current_user: UserIn = Depends(get_current_user)):
+async def get_user_profile(request: Request, current_user: UserIn = Depends(get_current_user)):
     query = User.__table__.select().where(User.id == current_user.id)
-    user = await database.fetch_one(query)
+    user = await read_router.fetch_one(query, sub=current_user.sub)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -194,7 +353,7 @@ async def get_user_profile(current_user: UserIn = Depends(get_current_user)):
         role=user.role,
         image_url=user.image_url
     )
-    return profile
+    return cached_json_response(request, profile, USER_PROFILE_FIELDS, PRIVATE)
 
 ## ユーザーの画像を登録
 @app.post("/user/image", tags=["user"], status_code=201)
@@ -205,46 +364,66 @@ async def register_user_image(image_data: UserImage, current_user: UserIn = Depe
         raise HTTPException(status_code=400, detail="Invalid URL")
 
     # 画像URLをユーザーデータベースに保存
+    user = await load_user_row(current_user)
     query = User.__table__.update().where(User.id == current_user.id).values(image_url=image_data.image_url)
     await database.execute(query)
+    await read_router.mark_written(current_user.sub)
+    principal_cache.invalidate(current_user.sub)
+    # 画像を登録し直した場合は取得元から取り直す
+    await image_cache.invalidate(image_data.image_url)
+    if user.image_url:
+        await image_cache.invalidate(user.image_url)
     return {"detail": "Image URL updated successfully"}
 
 ## ユーザーの画像を取得
 @app.get("/user/image", tags=["user"])
-async def get_user_image(current_user: UserIn = Depends(get_current_user)):
+async def get_user_image(request: Request, current_user: UserIn = Depends(get_current_user)):
     query = User.__table__.select().where(User.id == current_user.id)
-    user = await database.fetch_one(query)
+    user = await read_router.fetch_one(query, sub=current_user.sub)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     if not user.image_url:
         raise HTTPException(status_code=404, detail="No image associated with this user")
 
+    # キャッシュ済みの画像は取得元へのリクエストなしで返し、期限切れの場合は条件付きリクエストで再検証する
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(user.image_url)
-            if response.status_code != 200:
-                raise HTTPException(status_code=500, detail="Failed to fetch the image")
+        with timed("image_fetch"):
+            image = await image_cache.fetch(image_client, user.image_url)
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to fetch the image")
 
-    media_type = response.headers.get("Content-Type", "application/octet-stream")
-    return StreamingResponse(BytesIO(response.content), media_type=media_type)  # Assuming the image is JPEG. Adjust as needed.
+    # キャッシュできない画像は、本文をメモリに溜めずに受信したチャンクをそのままクライアントへ流す
+    if isinstance(image, httpx.Response):
+        media_type = image.headers.get("Content-Type", "application/octet-stream")
+        return StreamingResponse(image_client.iter(image), media_type=media_type)
+
+    headers = {"ETag": image.client_etag, "Cache-Control": "private, no-cache"}
+    if image.client_etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=image.body, media_type=image.content_type, headers=headers)
+
+## 自分の最近の投稿を取得
+@app.get("/user/posts", tags=["user"], response_model=List[PostOut])
+async def get_my_posts(limit: int = 5, current_user: UserIn = Depends(get_current_user)):
+    query = Post.__table__.select().where(Post.user_id == current_user.id).order_by(Post.id.desc()).limit(clamp_limit(limit))
+    posts = await read_router.fetch_all(query, sub=current_user.sub)
+    return json_response(posts, POST_FIELDS)
 
 ## ユーザーのプロフィールを取得
 @app.get("/user/profile/{user_id}", tags=["user"])
-async def get_user_profile(user_id: int, current_user: UserIn = Depends(get_current_user)):
+async def get_user_profile(request: Request, user_id: int, current_user: UserIn = Depends(get_current_user)):
     query = User.__table__.select().where(User.id == user_id)
-    user = await database.fetch_one(query)
+    user = await read_router.fetch_one(query, sub=current_user.sub)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    return cached_json_response(request, user, USER_PUBLIC_FIELDS, PRIVATE)
 
 ## 投稿の取得
 @app.get("/post/{post_id}", tags=["post"])
-async def get_post_by_id(post_id: int, current_user: str = Depends(get_current_user)):
+async def get_post_by_id(request: Request, post_id: int, current_user: str = Depends(get_current_user)):
     query = Post.__table__.select().where(Post.id == post_id)
-    post = await database.fetch_one(query)
+    post = await read_router.fetch_one(query, sub=current_user.sub)
 
     if post == None:
         raise HTTPException(status_code=404, detail="Post not found")
@@ -253,57 +432,116 @@ async def get_post_by_id(post_id: int, current_user: str = Depends(get_current_u
     if post.is_private and post.username != current_user.username:
         raise HTTPException(status_code=403, detail="Access to private post denied")
 
-    return post
+    # privateな投稿は共有キャッシュに保存させない
+    return cached_json_response(request, post, POST_FIELDS, PRIVATE if post.is_private else PUBLIC)
 
 ## 公開されている投稿の一覧を取得
+## 次のページは X-Next-Cursor ヘッダーの値を cursor に指定して取得する（skip は互換性のために残している）
 @app.get("/posts", tags=["post"], response_model=List[PostOut])
-async def get_posts(skip: int = 0, limit: int = 50):
-    query = Post.__table__.select().where(Post.is_private == False).offset(skip).limit(limit)
-    posts = await database.fetch_all(query)
-    return posts
+async def get_posts(request: Request, cursor: Optional[str] = None, skip: int = 0, limit: int = 50):
+    limit = clamp_limit(limit)
+    query = Post.__table__.select().where(Post.is_private == False).order_by(Post.id).limit(limit)
+    if cursor:
+        query = query.where(Post.id > decode_cursor(cursor))
+    elif skip:
+        query = query.offset(skip)
+    # 公開投稿の書き込み直後は、遅延したレプリカの内容でタイムラインのキャッシュが埋め直されないようプライマリから読む
+    posts = await read_router.fetch_all(query, table="posts")
+    headers = {}
+    if len(posts) == limit:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(posts[-1].id)
+    # postsテーブルの列はPostOutの項目と一致するため、行ごとのモデル検証は行わずにそのまま変換する
+    return cached_json_response(request, posts, POST_FIELDS, PUBLIC, headers=headers)
 
 ## 投稿の作成
 @app.post("/post/create", tags=["post"], response_model=PostOut, status_code=201)
-async def create_post(post: PostCreate, current_user: UserIn = Depends(get_current_user)):
-    query = Post.__table__.insert().values(title=post.title, content=post.content, user_id=current_user.id, username = current_user.username, is_private=post.is_private)
+async def create_post(post: PostCreate, background_tasks: BackgroundTasks, current_user: UserIn = Depends(get_current_user)):
+    values = dict(title=post.title, content=post.content, user_id=current_user.id, username=current_user.username, is_private=post.is_private)
+    query = Post.__table__.insert().values(**values)
     post_id = await database.execute(query)
-    query = Post.__table__.select().where(Post.id == post_id)
-    post = await database.fetch_one(query)
-    return post
+    await read_router.mark_written(current_user.sub, table=None if post.is_private else "posts")
+    if not post.is_private:
+        background_tasks.add_task(notify_posts_changed)
+    # 挿入した値から応答を組み立て、再度のSELECTは行わない
+    return PostOut(id=post_id, **values)
+
+## 投稿の一括作成
+@app.post("/post/batch", tags=["post"], response_model=List[PostOut], status_code=201)
+async def create_posts(posts: List[PostCreate], background_tasks: BackgroundTasks, current_user: UserIn = Depends(get_current_user)):
+    if len(posts) > POST_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"Too many posts (max {POST_BATCH_MAX_SIZE})")
+    if not posts:
+        return []
+
+    rows = [
+        dict(title=post.title, content=post.content, user_id=current_user.id, username=current_user.username, is_private=post.is_private)
+        for post in posts
+    ]
+    if app.state.consecutive_insert_ids:
+        # 複数行を1つのINSERT文で挿入する。MySQLは複数行INSERTで最初の行のidを返し、
+        # 行数が確定しているINSERTには連続したidを割り当てる（innodb_autoinc_lock_mode <= 1）
+        first_id = await database.execute(Post.__table__.insert().values(rows))
+        ids = [first_id + i for i in range(len(rows))]
+    else:
+        # 連続したidが保証されない場合は、1つのトランザクションで1行ずつ挿入して各行のidを取得する
+        async with database.transaction():
+            ids = [await database.execute(Post.__table__.insert().values(row)) for row in rows]
+    has_public = any(not post.is_private for post in posts)
+    await read_router.mark_written(current_user.sub, table="posts" if has_public else None)
+    if has_public:
+        background_tasks.add_task(notify_posts_changed)
+    return [PostOut(id=post_id, **row) for post_id, row in zip(ids, rows)]
 
 # 管理者用API
 ## ユーザーの一覧を取得
+## format=ndjson または Accept: application/x-ndjson を指定すると全件をストリーミングで返す
 @app.get("/admin/users", tags=["admin"])
-async def list_users(skip: int = 0, limit: int = 10, current_user: UserIn = Depends(get_current_user)):
+async def list_users(request: Request, skip: int = 0, limit: int = 10, format: Optional[str] = None, current_user: UserIn = Depends(get_current_user)):
     # roleがadminであることをチェック
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    query = User.__table__.select().offset(skip).limit(limit)
+    if wants_ndjson(request, format):
+        return ndjson_response(iter_rows(database, User.__table__.select(), User.id), USER_PUBLIC_FIELDS)
+
+    query = User.__table__.select().order_by(User.id).offset(skip).limit(limit)
     users = await database.fetch_all(query)
-    return users
+    return json_response(users, USER_PUBLIC_FIELDS)
 
 ## ユーザーの投稿を削除
 @app.delete("/admin/post/delete/{post_id}", tags=["admin"], status_code=200)
-async def delete_post(post_id: int, current_user: UserIn = Depends(get_current_user)):
+async def delete_post(post_id: int, background_tasks: BackgroundTasks, current_user: UserIn = Depends(get_current_user)):
     # roleがadminであることをチェック
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Not authorized")
 
     query = Post.__table__.delete().where(Post.id == post_id)
     await database.execute(query)
+    await read_router.mark_written(current_user.sub, table="posts")
+    background_tasks.add_task(notify_posts_changed)
     return {"detail": f"Post with id {post_id} deleted successfully"}
 
 ## 全ての投稿を取得
+## format=ndjson または Accept: application/x-ndjson を指定すると全件をストリーミングで返す
 @app.get("/admin/all_posts", tags=["admin"])
-async def get_all_posts(current_user: UserIn = Depends(get_current_user)):
+async def get_all_posts(request: Request, cursor: Optional[str] = None, limit: int = 100, format: Optional[str] = None, current_user: UserIn = Depends(get_current_user)):
     # roleがadminであることをチェック
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    query = Post.__table__.select()
+    if wants_ndjson(request, format):
+        return ndjson_response(iter_rows(database, Post.__table__.select(), Post.id), POST_FIELDS)
+
+    # テーブル全体を一度に読み込まないよう、idのカーソルでページ分割する
+    limit = clamp_limit(limit)
+    query = Post.__table__.select().order_by(Post.id).limit(limit)
+    if cursor:
+        query = query.where(Post.id > decode_cursor(cursor))
     posts = await database.fetch_all(query)
-    return posts
+    headers = {}
+    if len(posts) == limit:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(posts[-1].id)
+    return json_response(posts, POST_FIELDS, headers=headers)
 
 ## シークレット情報を取得（1つ目）
 @app.get("/admin/secret1", tags=["admin"])
@@ -355,4 +593,53 @@ async def get_developer_info(request: Request):
             "email": "kenji-a@email.example.com",
             "flag": SSRF_FLAG2
         }
-    }
\ No newline at end of file
+    }
+
+def internal_stats() -> dict:
+    return {
+        "hasher": hasher.stats(),
+        "rate_limiter": rate_limiter.stats(),
+        "db_pool": database.stats(),
+        "read_router": read_router.stats(),
+        "signing_keys": signing_keys.stats(),
+        "principal_cache": principal_cache.stats(),
+        "image_client": image_client.stats(),
+        "image_cache": image_cache.stats(),
+    }
+
+## 内部統計情報を取得
+@app.get("/internal/stats", tags=["internal"])
+async def get_internal_stats(request: Request):
+    # 内部からのアクセスでない場合、エラーを投げる
+    client_host = request.client.host
+    if client_host not in ("127.0.0.1", "::1"):
+        raise HTTPException(status_code=403, detail="Not allowed!")
+
+    return internal_stats()
+
+## Prometheus形式のメトリクスを取得
+@app.get("/metrics", tags=["internal"])
+async def get_metrics(request: Request):
+    # 内部からのアクセスでない場合、エラーを投げる
+    client_host = request.client.host
+    if client_host not in ("127.0.0.1", "::1"):
+        raise HTTPException(status_code=403, detail="Not allowed!")
+
+    return Response(content=render_metrics(internal_stats()), media_type="text/plain; version=0.0.4")
+
+## サンプリングプロファイラを指定した秒数だけ実行し、collapsed stack形式（flamegraph.pl / speedscope）で結果を取得
+@app.post("/internal/profile", tags=["internal"])
+async def run_profiler(request: Request, seconds: float = 10, interval: float = PROFILER_INTERVAL):
+    # 内部からのアクセスでない場合、エラーを投げる
+    client_host = request.client.host
+    if client_host not in ("127.0.0.1", "::1"):
+        raise HTTPException(status_code=403, detail="Not allowed!")
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler is disabled")
+
+    seconds = min(max(seconds, 0.1), PROFILER_MAX_SECONDS)
+    try:
+        output = await profiler.profile(seconds, max(interval, 0.001))
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return Response(content=output, media_type="text/plain", headers={"X-Profile-Samples": str(profiler.samples)})
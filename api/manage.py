@@ -0,0 +1,222 @@
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+from databases import Database
+from sqlalchemy import func
+from sqlalchemy.dialects import mysql
+
+from hashing import ARGON2_TIME_COST, PASSWORD_HASH_SCHEME, make_context
+from keys import JWT_KEYS_FILE, generate_key, read_key_file, write_key_file
+from models import User, Post
+
+DATABASE_URL = os.environ.get("DATABASE_URL")
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+# 「-- requires: UNIQUE_USERNAMES」のように、環境変数で有効にした場合だけ適用するマイグレーション
+REQUIRES_PREFIX = "-- requires:"
+
+
+## 重複しているユーザー名を検出・解消する
+async def dedupe_usernames(database: Database, resolve: bool):
+    query = (
+        User.__table__.select()
+        .with_only_columns([User.username, func.count(User.id).label("count")])
+        .group_by(User.username)
+        .having(func.count(User.id) > 1)
+    )
+    duplicates = await database.fetch_all(query)
+    if not duplicates:
+        print("No duplicate usernames found.")
+        return
+
+    for duplicate in duplicates:
+        query = User.__table__.select().with_only_columns([User.id]).where(User.username == duplicate.username).order_by(User.id)
+        rows = await database.fetch_all(query)
+        # 最も古いアカウント（idが最小）を正規の行として残し、残りはidを付けた名前に変更する
+        canonical, *others = [row.id for row in rows]
+        print(f"{duplicate.username}: {duplicate.count} rows (keep id={canonical}, rename ids={others})")
+        if not resolve:
+            continue
+        async with database.transaction():
+            for user_id in others:
+                query = User.__table__.update().where(User.id == user_id).values(username=f"{duplicate.username}_{user_id}")
+                await database.execute(query)
+
+    if not resolve:
+        print("Run again with --resolve to rename the duplicate rows.")
+    else:
+        print("Duplicates resolved. Enable UNIQUE_USERNAMES and run migrate to add the unique index.")
+
+
+def _enabled(name: str) -> bool:
+    return os.environ.get(name, "false").lower() in ("1", "true", "yes")
+
+
+## マイグレーションを適用する
+## requires の環境変数が有効でないものは適用済みとして記録せず、有効にした後の起動時に適用する
+async def migrate(database: Database, status_only: bool):
+    await database.execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version VARCHAR(255) PRIMARY KEY, "
+        "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    )
+    applied = {row[0] for row in await database.fetch_all("SELECT version FROM schema_migrations")}
+
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        if not filename.endswith(".sql"):
+            continue
+        version = filename[:-len(".sql")]
+        if version in applied:
+            print(f"[applied] {version}")
+            continue
+
+        with open(os.path.join(MIGRATIONS_DIR, filename), encoding="utf-8") as f:
+            sql = f.read()
+        requires = [line[len(REQUIRES_PREFIX):].strip() for line in sql.splitlines() if line.startswith(REQUIRES_PREFIX)]
+        disabled = [name for name in requires if not _enabled(name)]
+        if disabled:
+            print(f"[skipped] {version} (requires {', '.join(disabled)})")
+            continue
+        if status_only:
+            print(f"[pending] {version}")
+            continue
+
+        # MySQLのDDLはトランザクションで巻き戻せないため、1文ずつ実行して最後に適用済みとして記録する
+        for statement in sql.split(";"):
+            lines = [line for line in statement.splitlines() if not line.strip().startswith("--")]
+            statement = "\n".join(lines).strip()
+            if statement:
+                await database.execute(statement)
+        await database.execute("INSERT INTO schema_migrations (version) VALUES (:version)", {"version": version})
+        print(f"[applied] {version} (now)")
+
+
+## 各エンドポイントのクエリの実行計画を確認する
+def endpoint_queries():
+    # main.py の各ハンドラが発行するクエリと同じ形で組み立てる
+    return [
+        ("get_current_user", User.__table__.select().where(User.sub == "sub")),
+        ("register", User.__table__.select().with_only_columns([User.id]).where(User.username == "username").limit(1)),
+        ("login", User.__table__.select().with_only_columns([User.id, User.sub, User.username, User.role, User.hashed_password]).where(User.username == "username").order_by(User.id)),
+        ("refresh_token", User.__table__.select().with_only_columns([User.id, User.sub, User.username, User.role]).where(User.sub == "sub")),
+        ("get_user_profile", User.__table__.select().where(User.id == 1)),
+        ("get_user_image", User.__table__.select().where(User.id == 1)),
+        ("get_my_posts", Post.__table__.select().where(Post.user_id == 1).order_by(Post.id.desc()).limit(5)),
+        ("get_post_by_id", Post.__table__.select().where(Post.id == 1)),
+        ("get_posts", Post.__table__.select().where(Post.is_private == False).order_by(Post.id).limit(50)),
+        ("get_posts (cursor)", Post.__table__.select().where(Post.is_private == False).order_by(Post.id).limit(50).where(Post.id > 1)),
+        ("list_users", User.__table__.select().order_by(User.id).limit(10)),
+        ("get_all_posts", Post.__table__.select().order_by(Post.id).limit(100)),
+        ("get_all_posts (cursor)", Post.__table__.select().order_by(Post.id).limit(100).where(Post.id > 1)),
+        ("delete_post", Post.__table__.delete().where(Post.id == 1)),
+    ]
+
+
+async def explain(database: Database) -> bool:
+    ok = True
+    for name, query in endpoint_queries():
+        sql = str(query.compile(dialect=mysql.dialect(), compile_kwargs={"literal_binds": True}))
+        for row in await database.fetch_all("EXPLAIN " + sql):
+            plan = dict(row._mapping)
+            full_scan = plan.get("type") == "ALL"
+            ok = ok and not full_scan
+            print(f"{'FULL SCAN' if full_scan else 'ok':9} {name}: table={plan.get('table')} type={plan.get('type')} key={plan.get('key')}")
+    return ok
+
+
+## JWTの署名鍵をローテーションする
+def rotate_key(path: str, keep: int) -> int:
+    if not path:
+        print("JWT_KEYS_FILE is not set.")
+        return 1
+    keys = read_key_file(path)[1] if os.path.exists(path) else {}
+    kid, secret = generate_key()
+    keys[kid] = secret
+    # 新しい鍵で署名し、直近の keep 個の鍵は発行済みトークンの検証用に残す
+    kept = list(keys)[-keep:]
+    retired = [old_kid for old_kid in keys if old_kid not in kept]
+    write_key_file(path, kid, {k: keys[k] for k in kept})
+    print(f"Active key: {kid} (verifying: {', '.join(kept)}; retired: {', '.join(retired) or 'none'})")
+    return 0
+
+
+## 目標の照合時間に収まる最大のパスワードハッシュのコストを求める
+def calibrate_hash(scheme: str, target_ms: float, samples: int) -> int:
+    password = "calibration-password"
+    if scheme == "bcrypt":
+        candidates = [(f"BCRYPT_ROUNDS={rounds}", dict(bcrypt_rounds=rounds)) for rounds in range(4, 32)]
+    else:
+        # 時間コストは ARGON2_TIME_COST に固定し、メモリコスト（KiB）を倍にしていく
+        candidates = [(f"ARGON2_MEMORY_COST={8192 << n}", dict(argon2_memory_cost=8192 << n)) for n in range(10)]
+
+    chosen = None
+    for setting, options in candidates:
+        context = make_context(scheme, **options)
+        hashed_password = context.hash(password)
+        timings = []
+        for _ in range(samples):
+            started_at = time.perf_counter()
+            context.verify(password, hashed_password)
+            timings.append((time.perf_counter() - started_at) * 1000)
+        elapsed = statistics.median(timings)
+        print(f"{setting:30} {elapsed:9.1f} ms")
+        if elapsed > target_ms:
+            break
+        chosen = (setting, elapsed)
+
+    if chosen is None:
+        print(f"Even the lowest cost takes longer than {target_ms} ms on this machine.")
+        return 1
+    setting, elapsed = chosen
+    print(f"\nPASSWORD_HASH_SCHEME={scheme}")
+    if scheme == "argon2":
+        print(f"ARGON2_TIME_COST={ARGON2_TIME_COST}")
+    print(setting)
+    print(f"# {elapsed:.1f} ms per verification, about {1000 / elapsed:.0f} logins/s per hasher worker")
+    return 0
+
+
+async def main(args) -> int:
+    if args.command == "rotate-key":
+        return rotate_key(JWT_KEYS_FILE, args.keep)
+    if args.command == "calibrate-hash":
+        return calibrate_hash(args.scheme, args.target_ms, args.samples)
+
+    database = Database(DATABASE_URL)
+    await database.connect()
+    try:
+        if args.command == "dedupe-usernames":
+            await dedupe_usernames(database, args.resolve)
+        elif args.command == "migrate":
+            await migrate(database, args.status)
+        elif args.command == "explain":
+            return 0 if await explain(database) else 1
+    finally:
+        await database.disconnect()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintenance commands for the API database.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    dedupe = subparsers.add_parser("dedupe-usernames", help="find (and optionally resolve) duplicate usernames")
+    dedupe.add_argument("--resolve", action="store_true", help="rename every duplicate except the oldest account")
+
+    migrate_parser = subparsers.add_parser("migrate", help="apply pending migrations in api/migrations")
+    migrate_parser.add_argument("--status", action="store_true", help="only list applied and pending migrations")
+
+    subparsers.add_parser("explain", help="EXPLAIN every endpoint query and fail on full table scans")
+
+    rotate = subparsers.add_parser("rotate-key", help="add a new JWT signing key to JWT_KEYS_FILE and make it active")
+    rotate.add_argument("--keep", type=lambda value: max(int(value), 1), default=2, help="number of newest keys to keep for verification (default: 2)")
+
+    calibrate = subparsers.add_parser("calibrate-hash", help="pick the password hash cost that fits a target verify time on this machine")
+    calibrate.add_argument("--scheme", choices=("bcrypt", "argon2"), default=PASSWORD_HASH_SCHEME)
+    calibrate.add_argument("--target-ms", type=float, default=250, help="target time of one verification in milliseconds (default: 250)")
+    calibrate.add_argument("--samples", type=int, default=5, help="verifications timed per cost, the median is used (default: 5)")
+
+    sys.exit(asyncio.run(main(parser.parse_args())))
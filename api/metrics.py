@@ -0,0 +1,241 @@
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Sequence, Tuple
+
+from starlette.routing import Match
+
+# この時間（秒）以上かかったクエリをログに出力する
+SLOW_QUERY_SECONDS = float(os.environ.get("SLOW_QUERY_SECONDS", 0.2))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """
+    Prometheus-style cumulative histogram keyed by label values.
+
+    Updates happen on the event loop, so no locking is done.
+    """
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values: str):
+        series = self._series.get(label_values)
+        if series is None:
+            # [バケットごとの件数..., 合計, 件数]
+            series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self._series.items()):
+            labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, label_values))
+            prefix = labels + "," if labels else ""
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-2]}")
+            lines.append(f"{self.name}_count{{{labels}}} {series[-1]}")
+        return lines
+
+
+http_request_duration = Histogram(
+    "api_http_request_duration_seconds", "Time to handle a request, by route template.", ("method", "route", "status"), LATENCY_BUCKETS
+)
+http_request_db_queries = Histogram(
+    "api_http_request_db_queries", "Database queries issued while handling a request.", ("method", "route"), COUNT_BUCKETS
+)
+db_query_duration = Histogram(
+    "api_db_query_duration_seconds", "Database query latency (including pool wait), by query shape.", ("database", "shape"), LATENCY_BUCKETS
+)
+stage_duration = Histogram(
+    "api_stage_duration_seconds", "Time spent in an instrumented stage of request handling.", ("stage",), LATENCY_BUCKETS
+)
+password_hash_duration = Histogram(
+    "api_password_hash_duration_seconds", "Password hash and verify time on a hasher worker, by scheme and cost.", ("operation", "scheme", "cost"), LATENCY_BUCKETS
+)
+HISTOGRAMS = (http_request_duration, http_request_db_queries, db_query_duration, stage_duration, password_hash_duration)
+
+# リクエストごとのクエリ数（ミドルウェアが設定する）
+_request_queries: ContextVar = ContextVar("request_queries", default=None)
+
+# 文ごとに正規化したクエリの形（上限を超えたら作り直す）
+SHAPE_CACHE_SIZE = 1000
+_shapes: dict = {}
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_WHITESPACE = re.compile(r"\s+")
+# 複数行INSERTの2行目以降の VALUES (...) の組
+_VALUES_GROUPS = re.compile(r"(\bVALUES \([^()]*\))(?:, \([^()]*\))+", re.IGNORECASE)
+_METRIC_NAME = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]*")
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+@contextmanager
+def timed(stage: str):
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_duration.observe(time.perf_counter() - started_at, stage)
+
+
+class _QueryCounter:
+    __slots__ = ("count", "closed")
+
+    def __init__(self):
+        self.count = 0
+        self.closed = False
+
+
+def _statement_key(query):
+    if isinstance(query, str):
+        return query
+    # SQLAlchemyの文はバインドパラメータの値を除いたキャッシュキーで識別する（複数行INSERTなどキャッシュできない文はNone）
+    generate = getattr(query, "_generate_cache_key", None)
+    cache_key = generate() if generate is not None else None
+    return cache_key.key if cache_key is not None else None
+
+
+def query_shape(query) -> str:
+    """
+    Normalize a query to its shape: SQLAlchemy already renders bind parameters, raw SQL has its literals replaced.
+
+    Rows of a multi-row INSERT are collapsed into one group, so that every batch size shares a series.
+    """
+    key = _statement_key(query)
+    shape = _shapes.get(key) if key is not None else None
+    if shape is not None:
+        return shape
+    sql = query if isinstance(query, str) else str(query)
+    shape = _WHITESPACE.sub(" ", _LITERALS.sub("?", sql)).strip()
+    shape = _VALUES_GROUPS.sub(r"\1, ...", shape)
+    if key is not None:
+        if len(_shapes) >= SHAPE_CACHE_SIZE:
+            _shapes.clear()
+        _shapes[key] = shape
+    return shape
+
+
+@contextmanager
+def observe_query(database: str, query):
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started_at
+        shape = query_shape(query)
+        db_query_duration.observe(elapsed, database, shape)
+        counter = _request_queries.get()
+        if counter is not None and not counter.closed:
+            counter.count += 1
+        if elapsed >= SLOW_QUERY_SECONDS:
+            logger.warning("Slow query on %s (%.3fs): %s", database, elapsed, shape)
+
+
+def route_template(scope) -> str:
+    # パスパラメータごとに系列が増えないよう、/post/{post_id} のようなルートの定義で集計する
+    for route in getattr(scope.get("app"), "routes", []):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", scope["path"])
+    return "<unmatched>"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording per-route latency and the number of database queries per request.
+
+    Both are recorded when the last response body is sent, so background tasks run after the
+    response (and the queries they issue) are not counted.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.perf_counter()
+        status = [500]
+        queries = _QueryCounter()
+        token = _request_queries.set(queries)
+
+        def finish():
+            if queries.closed:
+                return
+            queries.closed = True
+            route = route_template(scope)
+            http_request_duration.observe(time.perf_counter() - started_at, scope["method"], route, str(status[0]))
+            http_request_db_queries.observe(queries.count, scope["method"], route)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish()
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_queries.reset(token)
+            # 応答を送り終える前に例外や切断で終わった場合
+            finish()
+
+
+def _render_stats(name: str, value, lines: List[str], label: str = ""):
+    if isinstance(value, dict):
+        # ホスト名などの識別子でないキーはラベルにする
+        if value and not all(_METRIC_NAME.fullmatch(str(key)) for key in value):
+            for key, item in value.items():
+                _render_stats(name, item, lines, f'{{key="{_escape(key)}"}}')
+            return
+        for key, item in value.items():
+            _render_stats(f"{name}_{key}", item, lines)
+        return
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, (int, float)):
+        lines.append(f"{name}{label} {value}")
+
+
+def render(stats: dict) -> str:
+    """
+    Render the histograms plus `stats` (the /internal/stats payload) as gauges in the Prometheus text format.
+    """
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    declared = set()
+    for component, values in stats.items():
+        gauges = []
+        _render_stats(f"api_{component}", values, gauges)
+        for gauge in gauges:
+            name = gauge.split("{")[0].split(" ")[0]
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(gauge)
+    return "\n".join(lines) + "\n"
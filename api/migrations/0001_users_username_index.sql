@@ -0,0 +1,2 @@
+-- ログイン時のユーザー名検索（login, register）
+CREATE INDEX idx_users_username ON users (username);
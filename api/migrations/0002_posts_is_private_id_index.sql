@@ -0,0 +1,2 @@
+-- 公開投稿のカーソルページング（get_posts: WHERE is_private = FALSE AND id > ? ORDER BY id）
+CREATE INDEX idx_posts_is_private_id ON posts (is_private, id);
@@ -0,0 +1,4 @@
+-- requires: UNIQUE_USERNAMES
+-- ユーザー名の重複登録を禁止する（register の確認とINSERTの間に同じユーザー名で登録される競合を防ぐ）
+-- 既存の重複があると失敗するため、manage.py dedupe-usernames --resolve で解消してから UNIQUE_USERNAMES を有効にする
+CREATE UNIQUE INDEX idx_users_username_unique ON users (username);
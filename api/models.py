@@ -1,23 +1,32 @@
-from sqlalchemy import create_engine, Column, Integer, String, Sequence, Boolean
+from sqlalchemy import create_engine, Column, Integer, String, Text, Sequence, Boolean, Enum, ForeignKey, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 Base = declarative_base()
 
+# db/init.sql と api/migrations のスキーマに合わせて定義する
 class User(Base):
     __tablename__ = 'users'
     id = Column(Integer, Sequence('user_id_seq'), primary_key=True)
-    username = Column(String(50))
-    sub = Column(String(50))
-    role = Column(String(50))
-    hashed_password = Column(String(100))
-    image_url = Column(String(100))
+    username = Column(String(255), nullable=False)
+    sub = Column(String(255), nullable=False, unique=True)
+    role = Column(Enum('admin', 'user'), server_default='user')
+    hashed_password = Column(String(255), nullable=False)
+    image_url = Column(String(255), server_default='https://via.placeholder.com/150')
+
+    __table_args__ = (
+        Index('idx_users_username', 'username'),
+    )
 
 class Post(Base):
     __tablename__ = 'posts'
     id = Column(Integer, Sequence('post_id_seq'), primary_key=True)
-    title = Column(String(100))
-    content = Column(String(500))
-    user_id = Column(Integer)
-    username = Column(String(50))
-    is_private = Column(Boolean, default=False)
+    title = Column(String(255), nullable=False)
+    content = Column(Text, nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'))
+    username = Column(String(255), nullable=False)
+    is_private = Column(Boolean, default=False, server_default=text('0'))
+
+    __table_args__ = (
+        Index('idx_posts_is_private_id', 'is_private', 'id'),
+    )
@@ -0,0 +1,35 @@
+import base64
+import json
+import os
+
+from fastapi import HTTPException
+
+# 1ページあたりの最大件数
+MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", 500))
+
+# 次ページのカーソルを返すレスポンスヘッダー
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_id: int) -> str:
+    """
+    Encode the id of the last row on a page as an opaque cursor token.
+    """
+    raw = json.dumps({"after": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        last_id = json.loads(raw)["after"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # JSONのtrue/falseはintのサブクラス（bool）として読み込まれるため、型を厳密に確認する
+    if type(last_id) is not int or last_id < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return last_id
+
+
+def clamp_limit(limit: int) -> int:
+    return max(1, min(limit, MAX_PAGE_SIZE))
@@ -0,0 +1,156 @@
+import asyncio
+import inspect
+import os
+import sys
+import threading
+from collections import Counter
+from typing import List
+
+# 稼働中のワーカーでサンプリングプロファイラを実行できるようにする（/internal/profile）
+PROFILER_ENABLED = os.environ.get("PROFILER_ENABLED", "false").lower() in ("1", "true", "yes")
+# 1回のプロファイルの最大時間（秒）と既定のサンプリング間隔（秒）
+PROFILER_MAX_SECONDS = float(os.environ.get("PROFILER_MAX_SECONDS", 60))
+PROFILER_INTERVAL = float(os.environ.get("PROFILER_INTERVAL", 0.005))
+
+# 処理を待っているだけのスレッドの末端のフレーム（イベントループのselect、ワーカースレッドのキュー待ちなど）
+IDLE_FRAMES = {
+    "selectors.py:select",
+    "threading.py:wait",
+    "thread.py:_worker",
+    "queue.py:get",
+    "connection.py:wait",
+}
+
+
+# コルーチン・ジェネレータのフレーム（イベントループから実行されているもの）
+COROUTINE_FLAGS = inspect.CO_COROUTINE | inspect.CO_ITERABLE_COROUTINE | inspect.CO_GENERATOR | inspect.CO_ASYNC_GENERATOR
+# 標準のイベントループがコールバックを実行するフレーム
+LOOP_FRAMES = {
+    "events.py:_run",
+    "base_events.py:_run_once",
+    "base_events.py:run_forever",
+    "base_events.py:run_until_complete",
+}
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _label(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _thread_stack(frame) -> List[str]:
+    stack = []
+    while frame is not None:
+        stack.append(_label(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _loop_base_frame(frame):
+    """
+    Walk out of the coroutines and asyncio callbacks running `frame` to the frame that drives the event loop.
+
+    With uvloop the loop itself has no Python frames, so an idle loop thread is parked in this frame
+    (e.g. asyncio.run or the gunicorn worker's run_until_complete call).
+    """
+    while frame is not None and (frame.f_code.co_flags & COROUTINE_FLAGS or _label(frame.f_code) in LOOP_FRAMES):
+        frame = frame.f_back
+    return frame
+
+
+def _task_stack(task: asyncio.Task) -> List[str]:
+    """
+    Follow the await chain of a suspended task from its outermost coroutine down to what it is waiting on.
+    """
+    stack = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            # Future.__await__() が返すイテレータは Future として表示する
+            name = type(awaitable).__name__
+            stack.append(f"<await {'Future' if name == 'FutureIter' else name}>")
+            break
+        stack.append(_label(frame.f_code))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+    return stack
+
+
+class SamplingProfiler:
+    """
+    Sample every thread's stack and every suspended asyncio task's await chain from a background thread.
+
+    On-CPU samples are rooted at `[cpu] <thread name>`. Samples of tasks waiting on I/O (MySQL, httpx,
+    executor futures, ...) are rooted at `[await]`, so waiting time lands under the handler that awaits it.
+    The output is the collapsed-stack format read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self):
+        self.running = False
+        self.samples = 0
+
+    async def profile(self, seconds: float, interval: float = PROFILER_INTERVAL) -> str:
+        if self.running:
+            raise ProfilerBusy()
+        self.running = True
+        self.samples = 0
+        loop = asyncio.get_running_loop()
+        # イベントループのスレッドが待機中かどうかを判定するため、ループを動かしているフレームを記録する
+        loop_thread = threading.get_ident()
+        base_frame = _loop_base_frame(sys._getframe())
+        counts = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample,
+            args=(loop, loop_thread, base_frame, asyncio.current_task(), counts, stop, interval),
+            name="profiler",
+            daemon=True,
+        )
+        try:
+            sampler.start()
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            sampler.join()
+            self.running = False
+        return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+    def _sample(self, loop, loop_thread: int, base_frame, own_task, counts: Counter, stop: threading.Event, interval: float):
+        me = threading.get_ident()
+        while not stop.wait(interval):
+            self.samples += 1
+            running = getattr(asyncio.tasks, "_current_tasks", {}).get(loop)
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                # タスクもコールバックも実行していないイベントループは、ループを動かしているフレームで止まっている
+                if ident == loop_thread and running is None and frame is base_frame:
+                    continue
+                stack = _thread_stack(frame)
+                if not stack or stack[-1] in IDLE_FRAMES:
+                    continue
+                counts[";".join([f"[cpu] {names.get(ident, ident)}"] + stack)] += 1
+
+            # 実行中のタスクはスレッドのスタックに含まれるため、中断中のタスクだけを数える（プロファイラ自身のタスクは除く）
+            try:
+                tasks = asyncio.all_tasks(loop)
+            except RuntimeError:
+                continue
+            for task in tasks:
+                if task is running or task is own_task:
+                    continue
+                try:
+                    stack = _task_stack(task)
+                except Exception:
+                    # イベントループ側でタスクが進んだ場合は、このサンプルでは数えない
+                    continue
+                if stack:
+                    counts[";".join(["[await]"] + stack)] += 1
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,197 @@
+import hashlib
+import ipaddress
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from fastapi import HTTPException
+
+# ログイン・ユーザー登録のレート制限を有効にする
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "false").lower() in ("1", "true", "yes")
+# クライアントIPごと・ユーザー名ごとの補充レート（回/分）とバースト（連続で許可する回数）
+RATE_LIMIT_IP_PER_MINUTE = float(os.environ.get("RATE_LIMIT_IP_PER_MINUTE", 60))
+RATE_LIMIT_IP_BURST = float(os.environ.get("RATE_LIMIT_IP_BURST", 20))
+RATE_LIMIT_USERNAME_PER_MINUTE = float(os.environ.get("RATE_LIMIT_USERNAME_PER_MINUTE", 10))
+RATE_LIMIT_USERNAME_BURST = float(os.environ.get("RATE_LIMIT_USERNAME_BURST", 5))
+# 全ワーカーで制限を共有する場合のRedisのURL（未設定の場合はワーカーごとのメモリ上で管理する）
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL")
+# メモリ上で保持するバケットの最大数
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", 100000))
+# X-Forwarded-For を信頼するプロキシ（フロントエンドなど）のIPアドレス・ネットワーク（カンマ区切り）
+RATE_LIMIT_TRUSTED_PROXIES = os.environ.get("RATE_LIMIT_TRUSTED_PROXIES", "")
+
+logger = logging.getLogger(__name__)
+
+# 残りトークンの補充と消費をRedis側で1回のスクリプト実行で行う（時刻もRedisのものを使う）
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RateLimited(HTTPException):
+    def __init__(self, retry_after: float):
+        super().__init__(
+            status_code=429,
+            detail="Too many attempts, please retry later",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+class MemoryBucketStore:
+    """
+    Token buckets kept in this process, evicting the least recently used key beyond `maxsize`.
+    """
+
+    def __init__(self, maxsize: int = RATE_LIMIT_MAX_KEYS, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        """
+        Take one token and return 0, or return the seconds until one is available (nothing is taken).
+        """
+        now = self.clock()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + max(0.0, now - updated_at) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class RedisBucketStore:
+    """
+    Token buckets shared by every worker through Redis.
+    """
+
+    def __init__(self, url: str):
+        # RATE_LIMIT_REDIS_URL を設定した場合だけ redis パッケージを読み込む
+        import redis.asyncio
+
+        self._client = redis.asyncio.from_url(url)
+        self._take = self._client.register_script(TAKE_SCRIPT)
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        return float(await self._take(keys=[f"ratelimit:{key}"], args=[rate, burst]))
+
+    def __len__(self) -> int:
+        return 0
+
+
+def _parse_networks(value: str) -> list:
+    return [ipaddress.ip_network(item.strip(), strict=False) for item in value.split(",") if item.strip()]
+
+
+class RateLimiter:
+    """
+    Token-bucket limits on an endpoint, per client IP and per username.
+
+    A failing shared store lets requests through rather than locking every user out.
+    """
+
+    def __init__(
+        self,
+        store=None,
+        enabled: bool = RATE_LIMIT_ENABLED,
+        ip_per_minute: float = RATE_LIMIT_IP_PER_MINUTE,
+        ip_burst: float = RATE_LIMIT_IP_BURST,
+        username_per_minute: float = RATE_LIMIT_USERNAME_PER_MINUTE,
+        username_burst: float = RATE_LIMIT_USERNAME_BURST,
+        trusted_proxies: str = RATE_LIMIT_TRUSTED_PROXIES,
+    ):
+        if store is None:
+            store = RedisBucketStore(RATE_LIMIT_REDIS_URL) if RATE_LIMIT_REDIS_URL else MemoryBucketStore()
+        self.store = store
+        self.enabled = enabled
+        self.ip_rate = ip_per_minute / 60
+        self.ip_burst = ip_burst
+        self.username_rate = username_per_minute / 60
+        self.username_burst = username_burst
+        self.trusted_proxies = _parse_networks(trusted_proxies)
+        self.allowed = 0
+        self.limited = 0
+        self.store_errors = 0
+
+    def _trusted(self, host: str) -> bool:
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        return any(address in network for network in self.trusted_proxies)
+
+    def client_ip(self, request) -> str:
+        # 信頼するプロキシからのリクエストの場合、X-Forwarded-For を右から辿って最初の信頼しないアドレスを使う
+        host = request.client.host if request.client else ""
+        if not self._trusted(host):
+            return host
+        forwarded = [item.strip() for item in request.headers.get("x-forwarded-for", "").split(",") if item.strip()]
+        for address in reversed(forwarded):
+            if not self._trusted(address):
+                return address
+        return forwarded[0] if forwarded else host
+
+    async def _take(self, key: str, rate: float, burst: float) -> float:
+        try:
+            return await self.store.take(key, rate, burst)
+        except Exception as e:
+            self.store_errors += 1
+            logger.warning("Rate limit store failed, allowing request: %s", e)
+            return 0.0
+
+    async def check(self, scope: str, request, username: Optional[str] = None):
+        """
+        Raise RateLimited when the client IP or the username has no token left for `scope`.
+        """
+        if not self.enabled:
+            return
+        wait = await self._take(f"{scope}:ip:{self.client_ip(request)}", self.ip_rate, self.ip_burst)
+        if not wait and username:
+            # 長いユーザー名でもキーの大きさが一定になるようハッシュ化する
+            digest = hashlib.sha256(username.lower().encode()).hexdigest()[:32]
+            wait = await self._take(f"{scope}:user:{digest}", self.username_rate, self.username_burst)
+        if wait:
+            self.limited += 1
+            raise RateLimited(wait)
+        self.allowed += 1
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "backend": "redis" if isinstance(self.store, RedisBucketStore) else "memory",
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "store_errors": self.store_errors,
+            "tracked_keys": len(self.store),
+        }
@@ -0,0 +1,69 @@
+"""
+Compare the per-row cost of the default response path (pydantic validation +
+jsonable_encoder + json.dumps) with the projected orjson path used when FAST_JSON is enabled.
+
+    cd api && python ../bench/bench_serialization.py --rows 500 --repeat 50
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine
+
+from main import POST_FIELDS, PostOut
+from models import Base, Post
+from serializers import project
+
+
+def load_rows(count: int):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(Post.__table__.insert(), [
+            dict(title=f"Title {i}", content="本文 " * 50, user_id=1, username="bench", is_private=False)
+            for i in range(count)
+        ])
+        return connection.execute(Post.__table__.select().order_by(Post.id)).fetchall()
+
+
+def default_path(rows) -> bytes:
+    content = [PostOut(**row._mapping) for row in rows]
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def fast_path(rows) -> bytes:
+    return orjson.dumps([project(row, POST_FIELDS) for row in rows])
+
+
+def measure(name: str, func, rows, repeat: int):
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        body = func(rows)
+    elapsed = time.perf_counter() - started_at
+    per_row_us = elapsed / (repeat * len(rows)) * 1e6
+    print(f"{name:8s} {per_row_us:8.2f} us/row  {len(body):8d} bytes/response")
+    return per_row_us
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rows = load_rows(args.rows)
+    assert json.loads(default_path(rows)) == json.loads(fast_path(rows))
+    default = measure("default", default_path, rows, args.repeat)
+    fast = measure("fast", fast_path, rows, args.repeat)
+    print(f"speedup  {default / fast:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
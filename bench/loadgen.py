@@ -0,0 +1,56 @@
+import asyncio
+import time
+from collections import Counter
+from typing import Awaitable, Callable
+
+import httpx
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+async def run_load(request: Callable[[], Awaitable[httpx.Response]], concurrency: int, duration: float) -> dict:
+    """
+    Call `request` from `concurrency` loops for `duration` seconds and summarize the latencies.
+
+    Responses with a 5xx status and transport errors count as errors; other statuses are
+    reported in `status` so expected 4xx answers (e.g. private posts) stay visible.
+    """
+    latencies = []
+    statuses = Counter()
+    errors = 0
+    deadline = time.monotonic() + duration
+
+    async def loop():
+        nonlocal errors
+        while time.monotonic() < deadline:
+            started_at = time.perf_counter()
+            try:
+                response = await request()
+                statuses[response.status_code] += 1
+                if response.status_code >= 500:
+                    errors += 1
+            except httpx.HTTPError:
+                statuses["transport_error"] += 1
+                errors += 1
+            latencies.append(time.perf_counter() - started_at)
+
+    started_at = time.monotonic()
+    await asyncio.gather(*(loop() for _ in range(concurrency)))
+    elapsed = time.monotonic() - started_at
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "status": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        "duration_seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
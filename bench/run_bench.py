@@ -0,0 +1,170 @@
+"""
+Drive the API hot paths concurrently and report RPS and latency percentiles per endpoint as JSON.
+
+Run bench/seed.py first, then:
+
+    python bench/run_bench.py --base-url http://localhost:7000 --output results.json
+    python bench/run_bench.py --baseline results.json --output new.json   # exits 1 on a regression
+
+Each endpoint is measured in its own phase (warmup, then `--duration` seconds at `--concurrency`).
+When the API runs in Docker, pass `--stub-url http://host.docker.internal:8089` so it can reach
+the stub image server started by this script.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+from loadgen import run_load
+from pagination import encode_cursor
+from seed import BENCH_PASSWORD, bench_username
+from stub_image_server import start_stub_server
+
+ENDPOINTS = ("login", "posts", "post", "create", "image")
+
+
+class Workload:
+    """
+    Request factories for each endpoint, sharing the tokens and ids discovered during setup.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, login_users: int):
+        self.client = client
+        self.login_users = login_users
+        self.tokens = []
+        self.max_post_id = 1
+
+    async def login(self, n: int) -> str:
+        data = {"username": bench_username(n), "password": BENCH_PASSWORD}
+        response = await self.client.post("/user/login", data=data)
+        response.raise_for_status()
+        return response.json()["access_token"]
+
+    async def setup(self, token_users: int, stub_url: str):
+        self.tokens = await asyncio.gather(*(self.login(n) for n in range(token_users)))
+        # 画像の取得元をスタブサーバに向ける（ユーザーごとに別のURLにしてキャッシュのエントリを分ける）
+        for n, token in enumerate(self.tokens):
+            response = await self.client.post("/user/image", headers=self._auth(token), json={"image_url": f"{stub_url}/image/{n}.png"})
+            response.raise_for_status()
+        response = await self.client.post("/post/create", headers=self._auth(self.tokens[0]), json={"title": "bench", "content": "bench"})
+        response.raise_for_status()
+        self.max_post_id = response.json()["id"]
+
+    def _auth(self, token: str = None) -> dict:
+        return {"Authorization": f"Bearer {token or random.choice(self.tokens)}"}
+
+    def request(self, endpoint: str):
+        if endpoint == "login":
+            data = {"username": bench_username(random.randrange(self.login_users)), "password": BENCH_PASSWORD}
+            return self.client.post("/user/login", data=data)
+        if endpoint == "posts":
+            return self.client.get("/posts", params={"cursor": encode_cursor(random.randrange(self.max_post_id))})
+        if endpoint == "post":
+            return self.client.get(f"/post/{random.randint(1, self.max_post_id)}", headers=self._auth())
+        if endpoint == "create":
+            return self.client.post("/post/create", headers=self._auth(), json={"title": "bench", "content": "ベンチマーク"})
+        if endpoint == "image":
+            return self.client.get("/user/image", headers=self._auth())
+        raise ValueError(f"Unknown endpoint: {endpoint}")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> bool:
+    ok = True
+    for endpoint, result in results["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(endpoint)
+        if not base or not base["rps"]:
+            continue
+        rps_change = result["rps"] / base["rps"] - 1
+        regressed = rps_change < -max_regression
+        ok = ok and not regressed
+        print(
+            f"{'REGRESSED' if regressed else 'ok':9} {endpoint:7} rps {base['rps']:.1f} -> {result['rps']:.1f} ({rps_change:+.1%}), "
+            f"p99 {base['p99_ms']:.1f} -> {result['p99_ms']:.1f} ms",
+            file=sys.stderr,
+        )
+    return ok
+
+
+async def run(args) -> dict:
+    stub = start_stub_server(port=args.stub_port, size=args.image_size)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30.0) as client:
+            workload = Workload(client, args.login_users)
+            await workload.setup(args.token_users, args.stub_url or f"http://127.0.0.1:{args.stub_port}")
+            endpoints = {}
+            for endpoint in args.endpoints.split(","):
+                request = lambda: workload.request(endpoint)
+                await run_load(request, args.concurrency, args.warmup)
+                endpoints[endpoint] = await run_load(request, args.concurrency, args.duration)
+                print(f"{endpoint:7} {endpoints[endpoint]['rps']:10.1f} req/s  p99 {endpoints[endpoint]['p99_ms']:.1f} ms", file=sys.stderr)
+    finally:
+        stub.shutdown()
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "base_url": args.base_url,
+            "concurrency": args.concurrency,
+            "duration_seconds": args.duration,
+            "warmup_seconds": args.warmup,
+            "token_users": args.token_users,
+            "login_users": args.login_users,
+            "image_size": args.image_size,
+        },
+        "endpoints": endpoints,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the API hot paths.")
+    parser.add_argument("--base-url", default=os.environ.get("BASE_URL", "http://localhost:7000"))
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help=f"comma-separated subset of {','.join(ENDPOINTS)}")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--token-users", type=int, default=20, help="benchmark users logged in up front for authenticated endpoints")
+    parser.add_argument("--login-users", type=int, default=1000, help="benchmark users the login phase picks from")
+    parser.add_argument("--stub-port", type=int, default=8089)
+    parser.add_argument("--stub-url", help="stub server URL as seen from the API (default: http://127.0.0.1:<stub-port>)")
+    parser.add_argument("--image-size", type=int, default=65536)
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="previous results to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.10, help="allowed relative RPS drop before failing (default: 0.10)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        return 0 if compare(results, baseline, args.max_regression) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+Local image origin for benchmarks: every GET returns the same PNG-typed body with an ETag and
+Cache-Control, and answers 304 to a matching If-None-Match.
+
+    python bench/stub_image_server.py --port 8089 --size 65536
+"""
+import argparse
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(body: bytes, max_age: int):
+    etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+
+    class StubImageHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", f"max-age={max_age}")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubImageHandler
+
+
+def start_stub_server(host: str = "0.0.0.0", port: int = 8089, size: int = 65536, max_age: int = 60) -> ThreadingHTTPServer:
+    """
+    Start the stub server on a daemon thread and return it (call `shutdown()` to stop).
+    """
+    body = b"\x89PNG\r\n\x1a\n" + bytes(max(size - 8, 0))
+    server = ThreadingHTTPServer((host, port), make_handler(body, max_age))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--size", type=int, default=65536, help="image body size in bytes")
+    parser.add_argument("--max-age", type=int, default=60)
+    args = parser.parse_args()
+    server = start_stub_server(args.host, args.port, args.size, args.max_age)
+    print(f"Serving stub images on {args.host}:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
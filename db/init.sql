@@ -2,6 +2,8 @@ SET NAMES utf8mb4;
 CREATE DATABASE IF NOT EXISTS mydatabase CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci;
 USE mydatabase;
 
+-- インデックスなどのスキーマ変更は api/migrations に追加し、APIサーバ起動時に manage.py migrate で適用する
+
 CREATE TABLE users 
 (
     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -0,0 +1,8 @@
+-- プライマリ（db）からGTIDの位置を自動で合わせて複製を開始する
+CHANGE MASTER TO
+    MASTER_HOST = 'db',
+    MASTER_USER = 'root',
+    MASTER_PASSWORD = 'rootpassword',
+    MASTER_CONNECT_RETRY = 5,
+    MASTER_AUTO_POSITION = 1;
+START SLAVE;
@@ -0,0 +1,110 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+API_BASE_URL = os.environ.get("API_BASE_URL", "http://api:7000")
+# APIサーバへのコネクションプールの大きさ（Flaskのワーカースレッド数以上にする）
+API_POOL_SIZE = int(os.environ.get("API_POOL_SIZE", 20))
+# 接続・読み込みのタイムアウト（秒）
+API_CONNECT_TIMEOUT = float(os.environ.get("API_CONNECT_TIMEOUT", 3.0))
+API_READ_TIMEOUT = float(os.environ.get("API_READ_TIMEOUT", 10.0))
+# 冪等なリクエスト（GET）の再試行回数とバックオフ係数
+API_RETRIES = int(os.environ.get("API_RETRIES", 2))
+API_RETRY_BACKOFF = float(os.environ.get("API_RETRY_BACKOFF", 0.2))
+# 1ページ内の独立したAPI呼び出しを並行して実行するスレッド数
+API_FANOUT_WORKERS = int(os.environ.get("API_FANOUT_WORKERS", 16))
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+class ApiClient:
+    """
+    Shared keep-alive session to the API server with timeouts, retries and latency metrics.
+    """
+
+    def __init__(self, base_url: str = API_BASE_URL):
+        self.base_url = base_url
+        self.timeout = (API_CONNECT_TIMEOUT, API_READ_TIMEOUT)
+        retry = Retry(
+            total=API_RETRIES,
+            backoff_factor=API_RETRY_BACKOFF,
+            # APIサーバは過負荷時（接続待ち・ハッシュ計算待ち）に503/429ですぐ失敗を返すため、それらは再試行しない。
+            # Retry-Afterに従うとurllib3はforcelist外の503/429も再試行し、応答を長く待たせるので無効にする
+            status_forcelist=(502, 504),
+            respect_retry_after_header=False,
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            raise_on_status=False,
+        )
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=API_POOL_SIZE, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._executor = ThreadPoolExecutor(max_workers=API_FANOUT_WORKERS, thread_name_prefix="api-fanout")
+
+    def request(self, method: str, path: str, timeout=None, **kwargs) -> requests.Response:
+        started_at = time.perf_counter()
+        failed = True
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=timeout or self.timeout, **kwargs)
+            failed = response.status_code >= 500
+            return response
+        finally:
+            self._record(method, path, time.perf_counter() - started_at, failed)
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def fan_out(self, **calls) -> dict:
+        """
+        Run independent API calls concurrently so a page waits for the slowest call, not the sum.
+
+        Returns a dict mapping each keyword to the call's result, or to the exception it raised.
+        """
+        futures = {name: self._executor.submit(call) for name, call in calls.items()}
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = e
+        return results
+
+    def _record(self, method: str, path: str, elapsed: float, failed: bool):
+        # /post/123 のようなパスは /post/{id} にまとめて集計する
+        key = f"{method} {_ID_SEGMENT.sub('/{id}', path.split('?')[0])}"
+        with self._lock:
+            metric = self._metrics.setdefault(key, {"count": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            metric["count"] += 1
+            metric["errors"] += int(failed)
+            metric["total_seconds"] += elapsed
+            metric["max_seconds"] = max(metric["max_seconds"], elapsed)
+
+    def stats(self) -> dict:
+        pools = {}
+        for key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            pools[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+                "idle_connections": sum(1 for connection in list(pool.pool.queue) if connection is not None) if pool.pool is not None else 0,
+                "maxsize": API_POOL_SIZE,
+            }
+        with self._lock:
+            endpoints = {
+                key: dict(metric, avg_seconds=metric["total_seconds"] / metric["count"])
+                for key, metric in self._metrics.items()
+            }
+        return {"pools": pools, "endpoints": endpoints}
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# タイムラインのキャッシュの有効期間（秒）と最大件数
+TIMELINE_CACHE_TTL = float(os.environ.get("TIMELINE_CACHE_TTL", 5))
+TIMELINE_CACHE_SIZE = int(os.environ.get("TIMELINE_CACHE_SIZE", 32))
+
+
+class FragmentCache:
+    """
+    Shared TTL/LRU cache for API payloads and rendered template fragments.
+
+    Concurrent misses on the same key are collapsed so only one thread calls the loader.
+    A value loaded while invalidate_all() ran is returned to its caller but not stored.
+    """
+
+    def __init__(self, maxsize: int = TIMELINE_CACHE_SIZE, ttl: float = TIMELINE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+        # invalidate_all() のたびに増やす世代
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _get(self, key):
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            return None
+        self._data.move_to_end(key)
+        return item[1]
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            value = self._get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+            load_lock = self._loading.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # 待っている間に他のスレッドが読み込んでいれば、それを使う
+            with self._lock:
+                value = self._get(key)
+                generation = self._generation
+            if value is not None:
+                return value
+            value = loader()
+            with self._lock:
+                # 読み込み中に無効化された場合、無効化前の内容かもしれないので保存しない
+                if generation == self._generation:
+                    self._data[key] = (time.monotonic() + self.ttl, value)
+                    self._data.move_to_end(key)
+                    while len(self._data) > self.maxsize:
+                        self._data.popitem(last=False)
+                self._loading.pop(key, None)
+            return value
+
+    def invalidate_all(self):
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,27 @@
+import multiprocessing
+import os
+
+# gunicornの設定（Flaskアプリをスレッド付きの複数プロセスで実行する）
+#   gunicorn -c gunicorn_conf.py main:app
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+# ページの描画はほとんどAPIサーバの応答待ちのため、スレッドで同時に処理する
+worker_class = "gthread"
+
+WORKERS_PER_CORE = float(os.environ.get("WORKERS_PER_CORE", 1))
+workers = int(os.environ.get("WEB_CONCURRENCY", max(int(multiprocessing.cpu_count() * WORKERS_PER_CORE), 2)))
+# ワーカーごとのスレッド数（API_POOL_SIZE以下にする）
+threads = int(os.environ.get("THREADS", 8))
+
+preload_app = os.environ.get("PRELOAD_APP", "false").lower() in ("1", "true", "yes")
+
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 30))
+timeout = int(os.environ.get("TIMEOUT", 60))
+keepalive = int(os.environ.get("KEEP_ALIVE", 5))
+
+max_requests = int(os.environ.get("MAX_REQUESTS", 0))
+max_requests_jitter = int(os.environ.get("MAX_REQUESTS_JITTER", 0))
+
+accesslog = os.environ.get("ACCESS_LOG", "-") or None
+errorlog = "-"
+loglevel = os.environ.get("LOG_LEVEL", "info")
@@ -1,13 +1,35 @@
 from flask import Flask, render_template, request, redirect, session, url_for, flash
+from markupsafe import Markup
 import logging
+import os
 import requests
 import secrets
+from api_client import ApiClient
+from fragment_cache import FragmentCache
+from session_keys import RotatingSessionInterface, load_secret_keys
 
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)
+# 全ワーカー・再起動後で共通の鍵でセッションを署名し、ローテーション前の鍵で署名されたセッションも受け付ける
+app.secret_key, *fallback_secret_keys = load_secret_keys()
+app.session_interface = RotatingSessionInterface(fallback_secret_keys)
 logging.basicConfig(level=logging.INFO)
 
-BASE_URL = "http://api:7000"
+# APIサーバへの接続はプールされたセッションを共有する
+api = ApiClient()
+
+# 公開タイムラインは全ユーザーで共通のため、描画済みの投稿カードを共有キャッシュする
+timeline_cache = FragmentCache()
+# APIサーバからのキャッシュ無効化通知に付与される共有トークン
+CACHE_INVALIDATION_TOKEN = os.environ.get("CACHE_INVALIDATION_TOKEN", "")
+
+# APIサーバがクライアントごとに試行回数を制限できるよう、接続元のアドレスを渡す
+def forwarded_for() -> dict:
+    return {"X-Forwarded-For": request.remote_addr}
+
+def too_many_attempts(e: requests.RequestException):
+    if e.response is not None and e.response.status_code == 429:
+        return "Too many attempts. Please wait a moment and try again."
+    return None
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -15,11 +37,11 @@ def register():
         username = request.form.get('username')
         password = request.form.get('password')
         try:
-            response = requests.post(f"{BASE_URL}/user/register", json={"username": username, "password": password})
+            response = api.post("/user/register", headers=forwarded_for(), json={"username": username, "password": password})
             response.raise_for_status()  # raises exception when not a 2xx response
         except requests.RequestException as e:
             logging.error(e)
-            flash("Registration failed. Please try again.")
+            flash(too_many_attempts(e) or "Registration failed. Please try again.")
             return render_template('register.html')
         
         return redirect(url_for('login'))
@@ -31,7 +53,7 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
         try:
-            response = requests.post(f"{BASE_URL}/user/login", data={
+            response = api.post("/user/login", headers=forwarded_for(), data={
                 "username": username,
                 "password": password,
                 "grant_type": "", 
@@ -46,7 +68,7 @@ def login():
                 return render_template('login.html')
         except requests.RequestException as e:
             logging.error(e)
-            flash("Login failed. Please try again.")
+            flash(too_many_attempts(e) or "Login failed. Please try again.")
             return render_template('login.html')
 
         return redirect(url_for('timeline'))
@@ -65,7 +87,7 @@ def create_post():
         headers = {"Authorization": f"Bearer {session['token']}"}
         
         try:
-            response = requests.post(f"{BASE_URL}/post/create", headers=headers, json={
+            response = api.post("/post/create", headers=headers, json={
                 "title": title, 
                 "content": content, 
                 "is_private": is_private
@@ -75,6 +97,7 @@ def create_post():
             logging.error(e)
             flash("Failed to create post. Please try again.")
             return render_template('create_post.html')
+        timeline_cache.invalidate_all()
 
         return redirect(url_for('timeline'))
     return render_template('create_post.html')
@@ -85,16 +108,20 @@ def timeline():
         flash("Please login first.")
         return redirect(url_for('login'))
     headers = {"Authorization": f"Bearer {session['token']}"}
-    try:
-        response = requests.get(f"{BASE_URL}/posts", headers=headers)
+
+    def render_cards():
+        response = api.get("/posts", headers=headers)
         response.raise_for_status()
-        posts = response.json()
+        return Markup(render_template('_post_cards.html', posts=response.json()))
+
+    try:
+        cards = timeline_cache.get_or_load('posts', render_cards)
     except requests.RequestException as e:
         logging.error(e)
         flash("Failed to fetch timeline. Please try again.")
         return redirect(url_for('login'))
 
-    return render_template('timeline.html', posts=posts)
+    return render_template('timeline.html', cards=cards)
 
 @app.route('/post/<int:post_id>')
 def view_post(post_id):
@@ -103,7 +130,7 @@ def view_post(post_id):
         return redirect(url_for('login'))
     headers = {"Authorization": f"Bearer {session['token']}"}
     try:
-        response = requests.get(f"{BASE_URL}/post/{post_id}", headers=headers)
+        response = api.get(f"/post/{post_id}", headers=headers)
         response.raise_for_status()
         post = response.json()
     except requests.RequestException as e:
@@ -119,8 +146,15 @@ def my_page():
         flash("Please login first.")
         return redirect(url_for('login'))
     headers = {"Authorization": f"Bearer {session['token']}"}
+    # ページ内の独立したAPI呼び出しは並行して実行する
+    results = api.fan_out(
+        profile=lambda: api.get("/user/profile", headers=headers),
+        posts=lambda: api.get("/user/posts", headers=headers, params={"limit": 5}),
+    )
     try:
-        response = requests.get(f"{BASE_URL}/user/profile", headers=headers)
+        response = results['profile']
+        if isinstance(response, Exception):
+            raise response
         response.raise_for_status()
         profile = response.json()
     except requests.RequestException as e:
@@ -128,7 +162,18 @@ def my_page():
         flash("Failed to fetch user data. Please try again.")
         return redirect(url_for('timeline'))
 
-    return render_template('my_page.html', profile=profile)
+    # 最近の投稿は取得できなくてもページ自体は表示する
+    posts = None
+    try:
+        response = results['posts']
+        if isinstance(response, Exception):
+            raise response
+        response.raise_for_status()
+        posts = response.json()
+    except requests.RequestException as e:
+        logging.error(e)
+
+    return render_template('my_page.html', profile=profile, posts=posts)
 
 @app.route('/user/image', methods=['GET'])
 def get_user_image():
@@ -136,12 +181,18 @@ def get_user_image():
         flash("Please login first.")
         return redirect(url_for('login'))
     headers = {"Authorization": f"Bearer {session['token']}"}
+    # ブラウザのキャッシュを再検証できるよう、ETagをAPIとの間で中継する
+    if request.headers.get('If-None-Match'):
+        headers['If-None-Match'] = request.headers['If-None-Match']
     try:
-        response = requests.get(f"{BASE_URL}/user/image", headers=headers)
+        response = api.get("/user/image", headers=headers)
         response.raise_for_status()
-        
+
+        cache_headers = {key: response.headers[key] for key in ('ETag', 'Cache-Control') if key in response.headers}
+        if response.status_code == 304:
+            return '', 304, cache_headers
         content_type = response.headers.get('Content-Type')
-        return response.content, 200, {'Content-Type': content_type}
+        return response.content, 200, {'Content-Type': content_type, **cache_headers}
     except requests.RequestException as e:
         logging.error(e)
         flash("Failed to fetch user image. Please try again.")
@@ -155,7 +206,7 @@ def update_user_image():
     headers = {"Authorization": f"Bearer {session['token']}"}
     image_url = request.form.get('image_url')
     try:
-        response = requests.post(f"{BASE_URL}/user/image", headers=headers, json={"image_url": image_url})
+        response = api.post("/user/image", headers=headers, json={"image_url": image_url})
         response.raise_for_status()
         logging.info(response.json())
         flash("Image URL updated successfully.")
@@ -165,5 +216,22 @@ def update_user_image():
         flash("Failed to update image URL. Please try again.")
         return redirect(url_for('timeline'))
 
+@app.route('/internal/metrics')
+def internal_metrics():
+    # 内部からのアクセスでない場合、エラーを投げる
+    if request.remote_addr not in ("127.0.0.1", "::1"):
+        return {"detail": "Not allowed!"}, 403
+    return {"api_client": api.stats(), "timeline_cache": timeline_cache.stats()}
+
+@app.route('/internal/cache/invalidate', methods=['POST'])
+def invalidate_cache():
+    # 内部からのアクセス、または共有トークンを持つAPIサーバからの通知でない場合、エラーを投げる
+    token = request.headers.get("X-Invalidation-Token", "")
+    authorized = bool(CACHE_INVALIDATION_TOKEN) and secrets.compare_digest(token, CACHE_INVALIDATION_TOKEN)
+    if not authorized and request.remote_addr not in ("127.0.0.1", "::1"):
+        return {"detail": "Not allowed!"}, 403
+    timeline_cache.invalidate_all()
+    return {"detail": "Cache invalidated"}
+
 if __name__ == '__main__':
     app.run(debug=True)
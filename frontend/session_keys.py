@@ -0,0 +1,63 @@
+import logging
+import os
+import secrets
+import tempfile
+
+from flask.sessions import SecureCookieSessionInterface
+from itsdangerous import URLSafeTimedSerializer
+
+# セッションの署名鍵（カンマ区切りで指定し、先頭の鍵で署名、残りは検証にのみ使う）
+FLASK_SECRET_KEYS = os.environ.get("FLASK_SECRET_KEYS")
+# 署名鍵のファイル（1行に1つ、先頭が署名用）。存在しない場合は新しい鍵を生成して作成する
+FLASK_SECRET_KEYS_FILE = os.environ.get("FLASK_SECRET_KEYS_FILE")
+
+
+def _create_key_file(path: str):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".secret_keys.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_hex(32) + "\n")
+        # 他のワーカーが先に作成していれば、そちらを使う
+        os.link(tmp_path, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp_path)
+
+
+def load_secret_keys(value: str = FLASK_SECRET_KEYS, path: str = FLASK_SECRET_KEYS_FILE) -> list:
+    """
+    Return the session keys, newest (signing) key first.
+    """
+    if value:
+        return [key.strip() for key in value.split(",") if key.strip()]
+    if path:
+        if not os.path.exists(path):
+            _create_key_file(path)
+        with open(path) as f:
+            return [line.strip() for line in f if line.strip()]
+    logging.warning("FLASK_SECRET_KEYS and FLASK_SECRET_KEYS_FILE are not set; sessions will not survive a restart")
+    return [secrets.token_hex(16)]
+
+
+class RotatingSessionInterface(SecureCookieSessionInterface):
+    """
+    Cookie sessions signed with `app.secret_key` that still accept cookies signed with older keys.
+    """
+
+    def __init__(self, fallback_keys: list):
+        self.fallback_keys = fallback_keys
+
+    def get_signing_serializer(self, app):
+        if not app.secret_key:
+            return None
+        signer_kwargs = dict(key_derivation=self.key_derivation, digest_method=self.digest_method)
+        # itsdangerousは最後の鍵で署名し、全ての鍵で検証する
+        return URLSafeTimedSerializer(
+            [*reversed(self.fallback_keys), app.secret_key],
+            salt=self.salt,
+            serializer=self.serializer,
+            signer_kwargs=signer_kwargs,
+        )
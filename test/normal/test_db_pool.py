@@ -0,0 +1,42 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# APIサーバを起動せずに、コネクションプールの上限を超えた待ちが503になることをSQLiteで確認する
+pytest.importorskip("databases")
+pytest.importorskip("aiosqlite")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "api"))
+
+from db import PoolExhausted, PooledDatabase
+
+
+def make_database(tmp_path):
+    return PooledDatabase(f"sqlite:///{tmp_path / 'pool.db'}", max_size=1, acquire_timeout=0.1)
+
+
+def test_queries_wait_for_the_gate_and_time_out(tmp_path):
+    async def run():
+        database = make_database(tmp_path)
+        await database.connect()
+        try:
+            await database.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)")
+            async with database.transaction():
+                # トランザクション内のクエリは同じ接続を使うため、ゲートで待たない
+                await database.execute("INSERT INTO items (name) VALUES ('a')")
+                assert await database.fetch_val("SELECT COUNT(*) FROM items") == 1
+                # 他のタスクは空き接続を待ち、時間切れで503になる
+                with pytest.raises(PoolExhausted) as excinfo:
+                    await asyncio.ensure_future(database.fetch_all("SELECT * FROM items"))
+            stats = database.stats()
+            assert [row._mapping["name"] async for row in database.iterate("SELECT name FROM items")] == ["a"]
+            return excinfo.value, stats, database.stats()
+        finally:
+            await database.disconnect()
+
+    error, during, after = asyncio.run(run())
+    assert error.status_code == 503
+    assert error.headers["Retry-After"]
+    assert during["timeouts"] == 1
+    assert after["in_use"] == 0
@@ -0,0 +1,18 @@
+import shutil
+import subprocess
+import pytest
+
+# docker-compose で起動したAPIコンテナ内で、各エンドポイントのクエリをEXPLAINする
+COMPOSE = shutil.which("docker-compose")
+
+@pytest.mark.skipif(COMPOSE is None, reason="docker-compose is not available")
+def test_no_full_table_scans():
+    result = subprocess.run(
+        [COMPOSE, "exec", "-T", "api", "python", "manage.py", "explain"],
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    print(result.stdout)
+    assert "FULL SCAN" not in result.stdout
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,50 @@
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+# APIサーバを起動せずに、高速な応答経路（FAST_JSON）がパスワードハッシュとsubを出力しないことを確認する
+pytest.importorskip("fastapi")
+pytest.importorskip("orjson")
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "api"))
+
+import main
+import serializers
+
+SECRET_COLUMNS = {"hashed_password", "sub"}
+
+
+def make_user_row(user_id):
+    mapping = {
+        "id": user_id,
+        "username": f"user{user_id}",
+        "sub": "9c3d153c-4951-4238-8a27-a0137469c2d4",
+        "role": "user",
+        "hashed_password": "$2b$12$abcdefghijklmnopqrstuv",
+        "image_url": "https://via.placeholder.com/150",
+    }
+    return SimpleNamespace(_mapping=mapping)
+
+
+@pytest.fixture
+def fast_json(monkeypatch):
+    monkeypatch.setattr(serializers, "FAST_JSON", True)
+
+
+def test_user_fields_exclude_secrets():
+    assert not SECRET_COLUMNS & set(main.USER_PUBLIC_FIELDS)
+    # BOLAの演習で使う項目は残す
+    assert {"username", "image_url"} <= set(main.USER_PUBLIC_FIELDS)
+
+
+def test_fast_path_user_responses_exclude_secrets(fast_json):
+    profile = json.loads(main.json_response(make_user_row(1), main.USER_PUBLIC_FIELDS).body)
+    users = json.loads(main.json_response([make_user_row(1), make_user_row(2)], main.USER_PUBLIC_FIELDS).body)
+    line = json.loads(serializers.encode_row(make_user_row(3), main.USER_PUBLIC_FIELDS))
+
+    for user in [profile, line] + users:
+        assert not SECRET_COLUMNS & set(user)
+        assert user["username"].startswith("user")
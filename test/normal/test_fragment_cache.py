@@ -0,0 +1,21 @@
+import os
+import sys
+
+# フロントエンドを起動せずに、読み込み中に無効化された内容がキャッシュに残らないことを確認する
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "frontend"))
+
+from fragment_cache import FragmentCache
+
+
+def test_value_loaded_during_invalidation_is_not_stored():
+    cache = FragmentCache(maxsize=4, ttl=60)
+
+    def stale_loader():
+        # 読み込みの途中で投稿の変更が通知された場合
+        cache.invalidate_all()
+        return "stale"
+
+    assert cache.get_or_load("timeline", stale_loader) == "stale"
+    assert cache.get_or_load("timeline", lambda: "fresh") == "fresh"
+    assert cache.get_or_load("timeline", lambda: "unused") == "fresh"
+    assert cache.stats()["hits"] == 1
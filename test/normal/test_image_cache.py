@@ -0,0 +1,107 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# APIサーバを起動せずに、全ユーザーで共有する画像キャッシュが private・no-store の応答を保存しないことを確認する
+httpx = pytest.importorskip("httpx")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "api"))
+
+from image_cache import ImageCache, freshness_lifetime
+
+IMAGE = b"\x89PNG\r\n\x1a\n" + bytes(100)
+
+
+class FakeImageClient:
+    """
+    Serves one image with the given Cache-Control, answering 304 to a matching If-None-Match.
+    """
+
+    def __init__(self, cache_control):
+        self.cache_control = cache_control
+        self.requests = 0
+
+    async def open(self, url, headers=None):
+        self.requests += 1
+        response_headers = {"Cache-Control": self.cache_control, "ETag": '"v1"'}
+        if headers and headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304, headers=response_headers)
+        response_headers.update({"Content-Type": "image/png", "Content-Length": str(len(IMAGE))})
+        return httpx.Response(200, headers=response_headers, content=IMAGE)
+
+    async def read(self, response):
+        return response.content
+
+
+@pytest.mark.parametrize("cache_control", ["private", "private, max-age=600", "no-store", "max-age=600, no-store"])
+def test_private_and_no_store_are_not_storable(cache_control):
+    assert freshness_lifetime(httpx.Headers({"Cache-Control": cache_control})) is None
+
+
+def test_public_max_age_is_used():
+    assert freshness_lifetime(httpx.Headers({"Cache-Control": "public, max-age=600"})) == 600.0
+
+
+@pytest.mark.parametrize("cache_control", ["private, max-age=600", "no-store"])
+def test_private_responses_are_not_shared(cache_control):
+    async def run():
+        cache = ImageCache(directory="")
+        client = FakeImageClient(cache_control)
+        first = await cache.fetch(client, "http://origin/image.png")
+        second = await cache.fetch(client, "http://origin/image.png")
+        return cache, client, first, second
+
+    cache, client, first, second = asyncio.run(run())
+    assert isinstance(first, httpx.Response) and isinstance(second, httpx.Response)
+    assert client.requests == 2
+    assert cache.stores == 0
+
+
+def test_revalidated_entry_turned_private_is_dropped():
+    async def run():
+        cache = ImageCache(directory="")
+        client = FakeImageClient("no-cache")
+        await cache.fetch(client, "http://origin/image.png")
+        # 取得元が private に変わった後の再検証（304）では、今回の応答にだけ使い、キャッシュから削除する
+        client.cache_control = "private"
+        revalidated = await cache.fetch(client, "http://origin/image.png")
+        return cache, revalidated, await cache.get("http://origin/image.png")
+
+    cache, revalidated, remaining = asyncio.run(run())
+    assert revalidated.body == IMAGE
+    assert remaining is None
+
+
+def test_invalidation_is_seen_by_other_workers(tmp_path):
+    async def run():
+        # 同じディスクキャッシュを共有する2つのワーカー
+        worker_a, worker_b = ImageCache(directory=str(tmp_path)), ImageCache(directory=str(tmp_path))
+        client = FakeImageClient("max-age=600")
+        await worker_a.fetch(client, "http://origin/image.png")
+        await worker_b.fetch(client, "http://origin/image.png")
+        cached_before = await worker_b.get("http://origin/image.png")
+
+        await worker_a.invalidate("http://origin/image.png")
+        cached_after = await worker_b.get("http://origin/image.png")
+        await worker_b.fetch(client, "http://origin/image.png")
+        return client, cached_before, cached_after, worker_b.stats()
+
+    client, cached_before, cached_after, stats = asyncio.run(run())
+    assert cached_before is not None
+    assert cached_after is None
+    assert client.requests == 2
+    assert stats["stale_memory"] == 1
+
+
+def test_rewrite_by_another_worker_replaces_memory_copy(tmp_path):
+    async def run():
+        worker_a, worker_b = ImageCache(directory=str(tmp_path)), ImageCache(directory=str(tmp_path))
+        await worker_b.fetch(FakeImageClient("max-age=600"), "http://origin/image.png")
+        entry = await worker_a.get("http://origin/image.png")
+        entry.expires_at += 100
+        await worker_a.put(entry, write_blob=False)
+        return entry.expires_at, (await worker_b.get("http://origin/image.png")).expires_at
+
+    expires_at_a, expires_at_b = asyncio.run(run())
+    assert expires_at_b == expires_at_a
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+# APIサーバを起動せずに、未知のkidのトークンで鍵ファイルの確認が繰り返されないことを確認する
+pytest.importorskip("jose")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "api"))
+
+import keys
+from jose import JWTError, jwt
+from keys import KeyStore
+
+
+def test_unknown_kids_do_not_reload_on_every_request(tmp_path, monkeypatch):
+    store = KeyStore(value=None, path=str(tmp_path / "jwt_keys.json"))
+    stats = []
+    real_stat = os.stat
+    monkeypatch.setattr(keys.os, "stat", lambda path, *args, **kwargs: stats.append(path) or real_stat(path, *args, **kwargs))
+    store._checked_at -= keys.JWT_KEYS_MIN_RELOAD_INTERVAL
+
+    for n in range(20):
+        token = jwt.encode({"sub": "attacker"}, "forged", algorithm="HS256", headers={"kid": f"forged-{n}"})
+        with pytest.raises(JWTError):
+            store.decode(token)
+    assert len(stats) == 1
+
+    # ローテーションされた正規の鍵は、間隔が空いていれば読み込まれる
+    store._checked_at -= keys.JWT_KEYS_MIN_RELOAD_INTERVAL
+    kid, secret = keys.generate_key()
+    keys.write_key_file(store.path, kid, {kid: secret, **store.keys})
+    token = jwt.encode({"sub": "user"}, secret, algorithm="HS256", headers={"kid": kid})
+    assert store.decode(token)["sub"] == "user"
@@ -0,0 +1,56 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+# APIサーバを起動せずに、応答後のバックグラウンド処理が計測に含まれないことと、クエリの形の正規化を確認する
+pytest.importorskip("fastapi")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "api"))
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+import metrics
+from metrics import MetricsMiddleware, observe_query, query_shape
+from models import Post
+
+
+async def app_with_background_task(scope, receive, send):
+    with observe_query("primary", "SELECT 1"):
+        pass
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}", "more_body": False})
+    # BackgroundTasks と同様に、応答を送った後に実行される処理
+    with observe_query("primary", "UPDATE users SET hashed_password = 'x'"):
+        time.sleep(0.3)
+
+
+def test_background_work_is_not_recorded():
+    async def send(message):
+        pass
+
+    scope = {"type": "http", "method": "POST", "path": "/metrics-test"}
+    asyncio.run(MetricsMiddleware(app_with_background_task)(scope, None, send))
+
+    series = metrics.http_request_db_queries._series[("POST", "<unmatched>")]
+    assert series[-2:] == [1, 1]
+    duration = metrics.http_request_duration._series[("POST", "<unmatched>", "200")]
+    assert duration[-2] < 0.3
+
+
+def test_multi_row_insert_shares_one_shape():
+    row = dict(title="t", content="c", user_id=1, username="u", is_private=False)
+    shapes = {query_shape(Post.__table__.insert().values([row] * n)) for n in (2, 3, 10)}
+    assert len(shapes) == 1
+    shape = shapes.pop()
+    assert shape.endswith("), ...")
+    assert "_m1" not in shape
+
+
+def test_shape_is_cached_per_statement(monkeypatch):
+    assert query_shape(Post.__table__.select().where(Post.id == 1)).startswith("SELECT")
+    # 同じ形の文はSQLにコンパイルし直さない
+    monkeypatch.setattr(metrics, "_WHITESPACE", None)
+    assert query_shape(Post.__table__.select().where(Post.id == 2)).startswith("SELECT")
+    monkeypatch.undo()
+    assert query_shape("SELECT * FROM posts WHERE id = 5") == "SELECT * FROM posts WHERE id = ?"
@@ -87,3 +87,65 @@ def test_get_posts():
     posts = get_posts()
     assert isinstance(posts, list)
     assert len(posts) > 0
+
+# 投稿の一覧をカーソルでページ送り
+def test_get_posts_with_cursor():
+    first_page = requests.get(f"{BASE_URL}/posts", params={"limit": 2})
+    assert first_page.status_code == 200
+    assert len(first_page.json()) == 2
+    cursor = first_page.headers["X-Next-Cursor"]
+
+    second_page = requests.get(f"{BASE_URL}/posts", params={"limit": 2, "cursor": cursor})
+    assert second_page.status_code == 200
+    first_ids = [post["id"] for post in first_page.json()]
+    second_ids = [post["id"] for post in second_page.json()]
+    assert len(second_ids) > 0
+    assert min(second_ids) > max(first_ids)
+
+    # 不正な形式、真偽値（{"after":true}）、負のid（{"after":-1}）のカーソルは400を返す
+    for cursor in ("invalid", "eyJhZnRlciI6dHJ1ZX0", "eyJhZnRlciI6LTF9"):
+        invalid = requests.get(f"{BASE_URL}/posts", params={"cursor": cursor})
+        assert invalid.status_code == 400
+
+# 投稿の一括作成
+def test_create_posts_in_batch():
+    token = login_user(username, password)
+    headers = {"Authorization": f"Bearer {token}"}
+    payload = [{"title": f"Batch Title {i}", "content": f"Batch Content {i}"} for i in range(3)]
+    response = requests.post(f"{BASE_URL}/post/batch", headers=headers, json=payload)
+    assert response.status_code == 201
+    posts = response.json()
+    assert len(posts) == 3
+    for i, post in enumerate(posts):
+        retrieved_post = get_post_by_id(post["id"], token)
+        assert retrieved_post["title"] == f"Batch Title {i}"
+        assert retrieved_post["content"] == f"Batch Content {i}"
+        assert retrieved_post["is_private"] == False
+
+# 投稿の一覧をETagで再検証
+def test_get_posts_not_modified():
+    response = requests.get(f"{BASE_URL}/posts")
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"].startswith("public")
+    etag = response.headers["ETag"]
+
+    not_modified = requests.get(f"{BASE_URL}/posts", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["ETag"] == etag
+
+# アクセストークンの再発行（STATELESS_TOKENSが有効な場合のみ）
+def test_refresh_token():
+    data = {"username": username, "password": password}
+    tokens = requests.post(f"{BASE_URL}/user/login", data=data).json()
+    if "refresh_token" not in tokens:
+        pytest.skip("STATELESS_TOKENS is disabled")
+
+    # リフレッシュトークンはアクセストークンとしては使えない
+    headers = {"Authorization": f"Bearer {tokens['refresh_token']}"}
+    assert requests.get(f"{BASE_URL}/user/profile", headers=headers).status_code == 401
+
+    response = requests.post(f"{BASE_URL}/user/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 200
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    profile = requests.get(f"{BASE_URL}/user/profile", headers=headers).json()
+    assert profile["username"] == username
@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+
+# APIサーバを起動せずに、ハッシュの方式・コストの変更が再ハッシュの対象になることを確認する
+pytest.importorskip("fastapi")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "api"))
+
+import hashing
+from hashing import hash_cost, make_context
+
+# db/init.sql で登録されているユーザーのハッシュ（コスト4）
+SEEDED_HASH = "$2a$04$5s7o.GoqcSl1GydjVVkkl.PJ8vgw3YCMTmYP0PjwNPbKt2qS4J21i"
+
+
+def test_bcrypt_rounds_change_needs_update():
+    context = make_context("bcrypt", bcrypt_rounds=5)
+    hashed_password = context.hash("password")
+    assert not context.needs_update(hashed_password)
+    assert context.needs_update(SEEDED_HASH)
+    assert make_context("bcrypt", bcrypt_rounds=6).needs_update(hashed_password)
+
+
+def test_switching_to_argon2_needs_update(monkeypatch):
+    pytest.importorskip("argon2")
+    context = make_context("argon2", argon2_time_cost=1, argon2_memory_cost=8192)
+    hashed_password = context.hash("password")
+    assert context.needs_update(SEEDED_HASH)
+    assert not context.needs_update(hashed_password)
+    assert context.verify("password", hashed_password)
+
+    monkeypatch.setattr(hashing, "pwd_context", context)
+    assert hash_cost(hashed_password) == ("argon2", "t=1,m=8192,p=1")
+
+
+def test_hash_cost_labels():
+    assert hash_cost(SEEDED_HASH) == ("bcrypt", "4")
+    assert hash_cost("not-a-hash") == ("unknown", "")
+
+
+def test_unknown_scheme_is_rejected():
+    with pytest.raises(ValueError):
+        make_context("md5_crypt")
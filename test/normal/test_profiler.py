@@ -0,0 +1,71 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+# APIサーバを起動せずに、プロファイラが待機中のイベントループをCPU使用として数えないことを確認する
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "api"))
+
+from profiler import SamplingProfiler
+
+
+def busy_work(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(1000))
+
+
+async def profile(busy: bool) -> str:
+    async def worker():
+        # GILの切り替え間隔（5ms）より長くCPUを使い、その合間にイベントループへ制御を戻す
+        for _ in range(20):
+            busy_work(0.02)
+            await asyncio.sleep(0.001)
+
+    async def waiter():
+        await asyncio.sleep(10)
+
+    tasks = [asyncio.ensure_future(waiter())]
+    if busy:
+        tasks.append(asyncio.ensure_future(worker()))
+    try:
+        return await SamplingProfiler().profile(0.3, 0.005)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def run(busy: bool, loop_factory) -> list:
+    loop = loop_factory()
+    try:
+        return loop.run_until_complete(profile(busy)).splitlines()
+    finally:
+        loop.close()
+
+
+def loop_factories():
+    factories = [pytest.param(asyncio.new_event_loop, id="asyncio")]
+    try:
+        import uvloop
+    except ImportError:
+        uvloop = None
+    factories.append(pytest.param(uvloop.new_event_loop if uvloop else None, id="uvloop", marks=pytest.mark.skipif(uvloop is None, reason="uvloop is not installed")))
+    return factories
+
+
+@pytest.mark.parametrize("loop_factory", loop_factories())
+def test_idle_loop_is_not_counted_as_cpu(loop_factory):
+    lines = run(False, loop_factory)
+    assert not [line for line in lines if line.startswith("[cpu] MainThread")]
+    # 中断中のタスクは数えるが、プロファイラ自身のタスクは含めない
+    assert any("waiter" in line for line in lines if line.startswith("[await]"))
+    assert not any(":profile" in line for line in lines if line.startswith("[await]"))
+
+
+@pytest.mark.parametrize("loop_factory", loop_factories())
+def test_busy_loop_is_counted_as_cpu(loop_factory):
+    lines = run(True, loop_factory)
+    assert any("busy_work" in line for line in lines if line.startswith("[cpu] MainThread"))
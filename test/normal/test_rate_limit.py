@@ -0,0 +1,115 @@
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+# APIサーバを起動せずに、メモリ上のストアでレート制限とハッシュ計算の受付制御を確認する
+pytest.importorskip("fastapi")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "api"))
+
+from hashing import HasherOverloaded, PasswordHasher
+from ratelimit import MemoryBucketStore, RateLimited, RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_request(host, forwarded_for=None):
+    headers = {"x-forwarded-for": forwarded_for} if forwarded_for else {}
+    return SimpleNamespace(client=SimpleNamespace(host=host), headers=headers)
+
+
+def make_limiter(clock, **kwargs):
+    options = dict(enabled=True, ip_per_minute=60, ip_burst=3, username_per_minute=6, username_burst=2, trusted_proxies="")
+    options.update(kwargs)
+    return RateLimiter(store=MemoryBucketStore(clock=clock), **options)
+
+
+def test_bucket_allows_burst_then_refills():
+    clock = FakeClock()
+    store = MemoryBucketStore(clock=clock)
+    waits = [asyncio.run(store.take("key", 1.0, 3)) for _ in range(4)]
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert waits[3] == pytest.approx(1.0)
+
+    clock.now += 1.0
+    assert asyncio.run(store.take("key", 1.0, 3)) == 0.0
+    assert asyncio.run(store.take("key", 1.0, 3)) > 0
+
+
+def test_bucket_store_is_bounded():
+    store = MemoryBucketStore(maxsize=2, clock=FakeClock())
+    for key in ("a", "b", "c"):
+        asyncio.run(store.take(key, 1.0, 1))
+    assert len(store) == 2
+
+
+def test_username_limit_applies_across_ips():
+    clock = FakeClock()
+    limiter = make_limiter(clock)
+    asyncio.run(limiter.check("login", make_request("10.0.0.1"), "alice"))
+    asyncio.run(limiter.check("login", make_request("10.0.0.2"), "Alice"))
+    with pytest.raises(RateLimited) as excinfo:
+        asyncio.run(limiter.check("login", make_request("10.0.0.3"), "alice"))
+    assert excinfo.value.status_code == 429
+    assert excinfo.value.headers["Retry-After"] == "10"
+
+    # 別のユーザー名は制限されない
+    asyncio.run(limiter.check("login", make_request("10.0.0.3"), "bob"))
+    clock.now += 10
+    asyncio.run(limiter.check("login", make_request("10.0.0.3"), "alice"))
+
+
+def test_ip_limit_applies_across_usernames():
+    limiter = make_limiter(FakeClock())
+    for n in range(3):
+        asyncio.run(limiter.check("login", make_request("10.0.0.1"), f"user{n}"))
+    with pytest.raises(RateLimited):
+        asyncio.run(limiter.check("login", make_request("10.0.0.1"), "user3"))
+    # エンドポイントごとに別のバケットを使う
+    asyncio.run(limiter.check("register", make_request("10.0.0.1"), "user3"))
+    assert limiter.stats()["limited"] == 1
+
+
+def test_forwarded_for_is_only_trusted_from_proxies():
+    limiter = make_limiter(FakeClock(), trusted_proxies="172.16.0.0/12")
+    assert limiter.client_ip(make_request("172.18.0.5", "203.0.113.7")) == "203.0.113.7"
+    assert limiter.client_ip(make_request("172.18.0.5", "198.51.100.1, 203.0.113.7")) == "203.0.113.7"
+    assert limiter.client_ip(make_request("203.0.113.9", "198.51.100.1")) == "203.0.113.9"
+
+
+def test_disabled_limiter_allows_everything():
+    limiter = make_limiter(FakeClock(), enabled=False)
+    for _ in range(10):
+        asyncio.run(limiter.check("login", make_request("10.0.0.1"), "alice"))
+
+
+def test_hasher_sheds_load_when_queue_is_full():
+    async def run():
+        hasher = PasswordHasher(kind="thread", workers=1, max_concurrency=1, max_queue=1)
+        hasher.start()
+        try:
+            running = asyncio.ensure_future(hasher._run(time.sleep, 0.2))
+            await asyncio.sleep(0.05)
+            queued = asyncio.ensure_future(hasher._run(time.sleep, 0))
+            await asyncio.sleep(0)
+            with pytest.raises(HasherOverloaded) as excinfo:
+                await hasher._run(time.sleep, 0)
+            await asyncio.gather(running, queued)
+            return excinfo.value, hasher.stats()
+        finally:
+            hasher.shutdown()
+
+    error, stats = asyncio.run(run())
+    assert error.status_code == 429
+    assert "Retry-After" in error.headers
+    assert stats["rejected"] == 1
+    assert stats["completed"] == 2
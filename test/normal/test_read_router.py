@@ -0,0 +1,83 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# APIサーバを起動せずに、書き込んだユーザーの読み込みが全ワーカーでプライマリに送られることを確認する
+pytest.importorskip("databases")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "api"))
+
+from db import ReadRouter
+
+
+class FakeDatabase:
+    def __init__(self, name):
+        self.name = name
+        self.is_connected = True
+
+    async def fetch_all(self, query):
+        return [self.name]
+
+    def stats(self):
+        return {}
+
+
+class FakeRedis:
+    """
+    The subset of redis.asyncio.Redis used by ReadRouter, shared by several routers like one Redis server.
+    """
+
+    def __init__(self):
+        self.keys = {}
+
+    async def set(self, key, value, px=None):
+        self.keys[key] = value
+
+    async def exists(self, *keys):
+        return sum(key in self.keys for key in keys)
+
+
+class BrokenRedis(FakeRedis):
+    async def exists(self, *keys):
+        raise ConnectionError("redis is down")
+
+
+def make_worker(redis):
+    router = ReadRouter(FakeDatabase("primary"), FakeDatabase("replica"), window=5)
+    router._redis = redis
+    return router
+
+
+def test_recent_write_is_seen_by_other_workers():
+    redis = FakeRedis()
+    worker_a, worker_b = make_worker(redis), make_worker(redis)
+
+    async def run():
+        assert await worker_b.fetch_all("query", sub="alice") == ["replica"]
+        await worker_a.mark_written("alice")
+        return await worker_b.fetch_all("query", sub="alice"), await worker_b.fetch_all("query", sub="bob")
+
+    assert asyncio.run(run()) == (["primary"], ["replica"])
+
+
+def test_list_read_after_write_reads_from_primary():
+    redis = FakeRedis()
+    worker_a, worker_b = make_worker(redis), make_worker(redis)
+
+    async def run():
+        await worker_a.mark_written("alice", table="posts")
+        # 書き込んだユーザー以外や匿名の一覧の読み込みもプライマリに送る（共有キャッシュを古い内容で埋めないため）
+        return (
+            await worker_b.fetch_all("query", sub="bob", table="posts"),
+            await worker_b.fetch_all("query", table="posts"),
+            await worker_b.fetch_all("query", table="users"),
+        )
+
+    assert asyncio.run(run()) == (["primary"], ["primary"], ["replica"])
+
+
+def test_unreachable_redis_reads_from_primary():
+    worker = make_worker(BrokenRedis())
+    assert asyncio.run(worker.fetch_all("query", sub="alice")) == ["primary"]
+    assert worker.stats()["shared_errors"] == 1
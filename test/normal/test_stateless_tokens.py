@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+# docker-compose では STATELESS_TOKENS を有効にしないため、APIサーバをプロセス内で起動してリフレッシュトークンを確認する
+pytest.importorskip("fastapi")
+pytest.importorskip("aiosqlite")
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "api"))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+
+import main
+from db import PooledDatabase, ReadRouter
+from models import Base
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    Base.metadata.create_all(create_engine(url))
+    database = PooledDatabase(url)
+    monkeypatch.setattr(main, "database", database)
+    monkeypatch.setattr(main, "read_router", ReadRouter(database, None))
+    monkeypatch.setattr(main, "STATELESS_TOKENS", True)
+    with TestClient(main.app) as client:
+        yield client
+
+
+def test_refresh_token_issues_working_access_token(client):
+    assert client.post("/user/register", json={"username": "alice", "password": "password"}).status_code == 201
+    tokens = client.post("/user/login", data={"username": "alice", "password": "password"}).json()
+    assert "refresh_token" in tokens
+
+    # リフレッシュトークンはアクセストークンとしては使えない
+    headers = {"Authorization": f"Bearer {tokens['refresh_token']}"}
+    assert client.get("/user/profile", headers=headers).status_code == 401
+
+    # アクセストークンをリフレッシュトークンとしても使えない
+    response = client.post("/user/token/refresh", json={"refresh_token": tokens["access_token"]})
+    assert response.status_code == 401
+
+    response = client.post("/user/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 200
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    profile = client.get("/user/profile", headers=headers)
+    assert profile.status_code == 200
+    assert profile.json()["username"] == "alice"